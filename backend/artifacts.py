@@ -0,0 +1,155 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# Modules
+import shared
+
+
+# Guards the artifacts against concurrent jobs
+_lock = threading.Lock()
+
+# Report outputs of the last ETL jobs ({job_id: {"job_id", "sid", "files": {format: {"name", "content", "media_type"}}, "delivered"}}), oldest first
+_artifacts = OrderedDict()
+
+
+def _history_size():
+    return int(os.getenv("ETL_ARTIFACTS_HISTORY", "10"))
+
+
+def _directory(job_id=None):
+    # With several workers, the report outputs are saved in the shared directory ("artifacts/<job_id>/"), so any worker sends them
+    return shared.path("artifacts", *([job_id] if job_id else []))
+
+
+def _read(job_id):
+    # Job ids are hexadecimal (never a path)
+    if not isinstance(job_id, str) or not job_id.isalnum():
+        return None
+
+    entry = shared.read_json(os.path.join(_directory(job_id), "entry.json"))
+
+    if entry is None:
+        return None
+
+    try:
+        files = {}
+
+        for file_format, file in entry["files"].items():
+            with open(os.path.join(_directory(job_id), file["name"]), "rb") as f:
+                files[file_format] = {**file, "content": f.read()}
+    except FileNotFoundError:
+        return None
+
+    return {**entry, "files": files, "delivered": set(entry["delivered"])}
+
+
+def _entries():
+    # Saved report outputs in the shared directory, newest first
+    entries = [
+        entry
+        for entry in (
+            shared.read_json(os.path.join(_directory(job_id), "entry.json"))
+            for job_id in (
+                os.listdir(_directory()) if os.path.isdir(_directory()) else []
+            )
+            if not job_id.endswith(".tmp")
+        )
+        if entry is not None
+    ]
+
+    return sorted(entries, key=lambda entry: entry["created"], reverse=True)
+
+
+def _save_shared(job, files):
+    # Write the files into a temporary directory renamed at the end, so other workers never read them half written
+    temporary_directory = f"{_directory(job.id)}.tmp"
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+    os.makedirs(temporary_directory)
+
+    for file in files.values():
+        with open(os.path.join(temporary_directory, file["name"]), "wb") as f:
+            f.write(file["content"])
+
+    shared.write_json(
+        os.path.join(temporary_directory, "entry.json"),
+        {
+            "job_id": job.id,
+            "sid": job.sid,
+            "files": {
+                file_format: {"name": file["name"], "media_type": file["media_type"]}
+                for file_format, file in files.items()
+            },
+            "delivered": [],
+            "created": time.time(),
+        },
+    )
+
+    with shared.lock("artifacts"):
+        os.replace(temporary_directory, _directory(job.id))
+
+        for entry in _entries()[_history_size() :]:
+            shutil.rmtree(_directory(entry["job_id"]), ignore_errors=True)
+
+
+def save(job, files):
+    # Keep the report outputs of an ETL job in memory so the report delivery uploads them without touching the disk (in the shared directory with several workers)
+    if shared.directory() is not None:
+        _save_shared(job, files)
+        return
+
+    with _lock:
+        _artifacts[job.id] = {
+            "job_id": job.id,
+            "sid": job.sid,
+            "files": files,
+            # Destinations that already received the report, skipped when it is sent again
+            "delivered": set(),
+        }
+
+        while len(_artifacts) > _history_size():
+            _artifacts.popitem(last=False)
+
+
+def get(job_id):
+    if shared.directory() is not None:
+        return _read(job_id)
+
+    with _lock:
+        return _artifacts.get(job_id)
+
+
+def latest(sid):
+    # Report outputs of the last ETL job requested by a client
+    if shared.directory() is not None:
+        for entry in _entries():
+            if entry["sid"] == sid:
+                return _read(entry["job_id"])
+
+        return None
+
+    with _lock:
+        for artifact in reversed(_artifacts.values()):
+            if artifact["sid"] == sid:
+                return artifact
+
+    return None
+
+
+def mark_delivered(job_id, destination):
+    if shared.directory() is not None:
+        with shared.lock("artifacts"):
+            entry_path = os.path.join(_directory(job_id), "entry.json")
+            entry = shared.read_json(entry_path)
+
+            if entry is not None and destination not in entry["delivered"]:
+                entry["delivered"].append(destination)
+                shared.write_json(entry_path, entry)
+
+        return
+
+    with _lock:
+        if job_id in _artifacts:
+            _artifacts[job_id]["delivered"].add(destination)
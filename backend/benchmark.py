@@ -0,0 +1,321 @@
+# Run offline benchmark with terminal command: python benchmark.py [--scenarios 6x1 6x30 100x30 300x365] [--simem-cache]
+# Each scenario ("<plants>x<days>") runs the whole ETL in its own process against a local SIMEM API stand-in and a Drive folder on disk
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import xlsxwriter
+
+
+# First day of the synthetic data
+START_DATE = date(2024, 1, 1)
+
+# Maximum number of days per synthetic capacity workbook (keeps every sheet under the XLSX row limit)
+DAYS_PER_WORKBOOK = 31
+
+# Plants in the national dispatch that are not in the registry (SIMEM sends them anyway)
+OTHER_PLANTS = 200
+
+
+def plant_codes(count, prefix="P"):
+    return [f"{prefix}{index:04d}" for index in range(count)]
+
+
+def file_md5(path):
+    with open(path, "rb") as file:
+        return hashlib.md5(file.read()).hexdigest()
+
+
+def file_modified_date(path):
+    # RFC 3339 in UTC, as reported by Google Drive
+    return datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.%fZ"
+    )
+
+
+class LocalDrive:
+    # Stand-in for pydrive2's GoogleDrive backed by a folder on disk
+    def __init__(self, folder):
+        self.folder = folder
+
+    def ListFile(self, params=None):
+        return LocalFileList(self)
+
+    def CreateFile(self, metadata=None):
+        return LocalFile(self, metadata or {})
+
+
+class LocalFileList:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def GetList(self):
+        return [
+            LocalFile(
+                self.drive,
+                {
+                    "id": file_name,
+                    "title": file_name,
+                    "md5Checksum": file_md5(os.path.join(self.drive.folder, file_name)),
+                    "modifiedDate": file_modified_date(
+                        os.path.join(self.drive.folder, file_name)
+                    ),
+                },
+            )
+            for file_name in sorted(os.listdir(self.drive.folder))
+            if os.path.isfile(os.path.join(self.drive.folder, file_name))
+        ]
+
+
+class LocalFile(dict):
+    def __init__(self, drive, metadata):
+        super().__init__(metadata)
+        self.drive = drive
+        self.content = None
+        self.dirty = {"content": False}
+
+    def FetchContent(self):
+        with open(os.path.join(self.drive.folder, self["id"]), "rb") as file:
+            self.content = io.BytesIO(file.read())
+
+    def Upload(self):
+        uploads = os.path.join(self.drive.folder, "uploads")
+        os.makedirs(uploads, exist_ok=True)
+
+        with open(os.path.join(uploads, self["title"]), "wb") as file:
+            file.write(self.content.getvalue())
+
+
+def write_capacity_workbooks(folder, plants, days):
+    # Synthetic "capacidad de generación" workbooks with the same layout as the real ones (4 preamble rows; FECHA, PLANTA, GENERADOR, CAPACIDAD, CODIGO)
+    for first_day in range(0, days, DAYS_PER_WORKBOOK):
+        workbook = xlsxwriter.Workbook(
+            os.path.join(folder, f"capacidad_{first_day:04d}.xlsx"),
+            {"constant_memory": True},
+        )
+        worksheet = workbook.add_worksheet()
+
+        for row in range(4):
+            worksheet.write(row, 0, f"Encabezado {row}")
+
+        row = 4
+
+        for day in range(first_day, min(first_day + DAYS_PER_WORKBOOK, days)):
+            fecha = START_DATE + timedelta(days=day)
+
+            for codigo in plants:
+                for hora in range(24):
+                    worksheet.write_row(
+                        row,
+                        0,
+                        [
+                            f"{fecha} {hora:02d}:00",
+                            "PLANTA",
+                            "GENERADOR",
+                            random.randint(0, 50_000),
+                            codigo,
+                        ],
+                    )
+                    row += 1
+
+        workbook.close()
+
+
+def simem_handler(plants):
+    national_plants = plants + plant_codes(OTHER_PLANTS, prefix="X")
+
+    class SimemHandler(BaseHTTPRequestHandler):
+        # Local stand-in for SIMEM PublicData API ("Despacho programado" and "Precio de bolsa ponderado")
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            start = date.fromisoformat(query["startdate"][0])
+            end = date.fromisoformat(query["enddate"][0])
+            records = []
+
+            for offset in range((end - start).days + 1):
+                fecha = start + timedelta(days=offset)
+
+                if query["datasetId"][0] == "ff027b":
+                    records.extend(
+                        {
+                            "FechaHora": f"{fecha}T{hora:02d}:00:00",
+                            "CodigoPlanta": codigo,
+                            "CodigoVariable": "DespachoProgramado",
+                            "Version": "TXR",
+                            "Valor": random.randint(0, 50_000),
+                        }
+                        for codigo in national_plants
+                        for hora in range(24)
+                    )
+                else:
+                    records.append(
+                        {
+                            "FechaHora": f"{fecha}T00:00:00",
+                            "CodigoVariable": "PPBOGReal",
+                            "Version": "TXR",
+                            "Valor": round(random.uniform(100, 900), 2),
+                        }
+                    )
+
+            body = json.dumps({"result": {"records": records}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return SimemHandler
+
+
+def run_scenario(plants_count, days, simem_cache):
+    # Prepare the synthetic inputs, run the ETL once and print its stage timings and peak RSS as JSON
+    workdir = tempfile.mkdtemp(prefix="balance_energia_benchmark_")
+    drive_folder = os.path.join(workdir, "drive")
+    os.makedirs(drive_folder)
+
+    plants = plant_codes(plants_count)
+    write_capacity_workbooks(drive_folder, plants, days)
+
+    with open(os.path.join(workdir, "generadores.toml"), "w") as config_file:
+        config_file.write(f"generadores = {json.dumps(plants)}\n")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), simem_handler(plants))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["SIMEM_BASE_URL"] = (
+        f"http://127.0.0.1:{server.server_port}/backend-files/api/PublicData"
+    )
+    os.environ["SIMEM_CACHE_ENABLED"] = "true" if simem_cache else "false"
+    os.environ["SIMEM_CACHE_DIR"] = os.path.join(workdir, "simem_cache")
+    os.environ["GENERADORES_FILE"] = os.path.join(workdir, "generadores.toml")
+    os.chdir(workdir)
+
+    # Imported after the environment is ready, as the server would do
+    import etl
+    from google_auth import drive_session
+    from jobs import JobManager
+
+    drive_session.connect = lambda: LocalDrive(drive_folder)
+    messages = []
+
+    async def emit(event, data=None, to=None):
+        messages.append((event, data))
+
+    async def main():
+        job_manager = JobManager(emit=emit)
+        job = job_manager.submit(
+            "etl", "benchmark", etl.start_etl, {"range": True, "timings": True}
+        )
+        start = time.perf_counter()
+        await job.task
+        total = time.perf_counter() - start
+        job_manager.shutdown()
+
+        return job, total
+
+    job, total = asyncio.run(main())
+    errors = [
+        message
+        for event, data in messages
+        if event == "events_messages"
+        for message in (data if isinstance(data, list) else [data])
+        if message["status"] == "error"
+    ]
+
+    print(
+        json.dumps(
+            {
+                "estado": job.status,
+                "errores": errors,
+                "etapas": job.timings,
+                "total": round(total, 4),
+                # ru_maxrss is reported in kilobytes on Linux
+                "rss_mb": round(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+                ),
+            }
+        )
+    )
+
+    server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ETL benchmark")
+    parser.add_argument(
+        "--scenarios", nargs="+", default=["6x1", "6x30", "100x30", "300x365"]
+    )
+    parser.add_argument("--simem-cache", action="store_true")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        plants_count, days = (int(value) for value in args.run.split("x"))
+        run_scenario(plants_count, days, args.simem_cache)
+        return
+
+    results = {}
+
+    for scenario in args.scenarios:
+        print(f"Running scenario {scenario}...", file=sys.stderr)
+        command = [sys.executable, os.path.abspath(__file__), "--run", scenario]
+
+        if args.simem_cache:
+            command.append("--simem-cache")
+
+        output = subprocess.run(
+            command,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        )
+
+        if output.returncode != 0:
+            print(output.stderr, file=sys.stderr)
+            continue
+
+        results[scenario] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    stages = list(
+        dict.fromkeys(
+            stage for result in results.values() for stage in result["etapas"]
+        )
+    )
+    header = ["escenario", *stages, "total", "rss_mb", "estado"]
+    print(" | ".join(header))
+
+    for scenario, result in results.items():
+        print(
+            " | ".join(
+                [
+                    scenario,
+                    *[f"{result['etapas'].get(stage, 0):.3f}" for stage in stages],
+                    f"{result['total']:.3f}",
+                    f"{result['rss_mb']:.1f}",
+                    result["estado"] if not result["errores"] else "errores",
+                ]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Run the ETL without the server with terminal command: python cli.py [--fecha 2024-09-01 ...] [--range] [--incremental] [--hourly] [--enviar] [--forzar] [--escenarios escenarios.json] [--portafolios [norte sur]] [--profile]
+# Only the pipeline modules are imported (not FastAPI nor Socket.IO), so scheduled runs (e.g. from cron) start quickly
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import date
+
+from dotenv import load_dotenv
+
+# Modules
+import pipeline
+import profiling
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the energy balance ETL")
+    parser.add_argument(
+        "--fecha",
+        nargs="+",
+        type=date.fromisoformat,
+        default=[None],
+        help="dates to process, several at once up to ETL_MAX_PARALLEL_DATES (by default, the files of the extraction folder)",
+    )
+    parser.add_argument("--range", action="store_true", help="read every XLSX file")
+    parser.add_argument(
+        "--incremental", action="store_true", help="only new or modified XLSX files"
+    )
+    parser.add_argument("--hourly", action="store_true", help="hourly balance")
+    parser.add_argument(
+        "--enviar", action="store_true", help="send the report after each run"
+    )
+    parser.add_argument(
+        "--forzar",
+        action="store_true",
+        help="process dates already saved in the history",
+    )
+    parser.add_argument(
+        "--escenarios",
+        type=argparse.FileType(encoding="utf-8"),
+        help="JSON file with the scenario matrix to evaluate",
+    )
+    parser.add_argument(
+        "--portafolios",
+        nargs="*",
+        help="portfolios to process together (every configured portfolio when no name is given)",
+    )
+    parser.add_argument("--timings", action="store_true")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="save a CPU and allocation profile of each run (ETL_PROFILE_DIR)",
+    )
+    args = parser.parse_args()
+
+    # Load environment variables from .env file
+    load_dotenv()
+
+    options = {
+        "range": args.range,
+        "incremental": args.incremental,
+        "hourly": args.hourly,
+        "timings": args.timings,
+        "dedup": not args.forzar,
+        "profile": args.profile,
+    }
+
+    if args.escenarios is not None:
+        options["escenarios"] = json.load(args.escenarios)
+
+    if args.portafolios is not None:
+        options["portafolios"] = args.portafolios or True
+
+    jobs, errors = asyncio.run(
+        pipeline.run_headless(args.fecha, options, send=args.enviar)
+    )
+
+    for job in jobs:
+        if args.timings:
+            print(f"Job {job.id}: {job.timings}")
+
+        if args.profile:
+            print(f"Job {job.id}: profile in {profiling.path(job.id, 'cpu')}")
+
+    # Non-zero exit status when a run failed, so the scheduler running the command can report it
+    if errors > 0 or any(job.status != "finalizado" for job in jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import asyncio
+import io
+import os
+import random
+import time
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+
+# Modules
+from google_auth import drive_session
+import artifacts
+import metrics
+
+
+# Google Drive resumable uploads require chunks that are a multiple of 256 KiB
+DRIVE_CHUNK_MULTIPLE = 256 * 1024
+
+
+def _settings():
+    return {
+        "destinations": [
+            name.strip()
+            for name in os.getenv("REPORT_DESTINATIONS", "fastupload,drive").split(",")
+            if name.strip()
+        ],
+        "chunk_bytes": int(os.getenv("DELIVERY_CHUNK_BYTES", str(1024**2))),
+        "timeout": float(os.getenv("DELIVERY_TIMEOUT_SECONDS", "60")),
+        "max_retries": int(os.getenv("DELIVERY_MAX_RETRIES", "3")),
+        "backoff_factor": float(os.getenv("DELIVERY_BACKOFF_FACTOR", "0.5")),
+        "progress_interval": float(os.getenv("DELIVERY_PROGRESS_SECONDS", "0.5")),
+        # Report format received by each destination, replacing its default one ("drive=xlsx,archive=parquet")
+        "formats": dict(
+            item.strip().split("=", 1)
+            for item in os.getenv("REPORT_DESTINATION_FORMATS", "").split(",")
+            if "=" in item
+        ),
+        "archive_directory": os.getenv("REPORT_ARCHIVE_DIR", "informes"),
+    }
+
+
+# Destination plugins by name (the names used in REPORT_DESTINATIONS)
+DESTINATIONS = {}
+
+
+def register(destination):
+    # Class decorator that makes a destination plugin available
+    DESTINATIONS[destination.name] = destination
+
+    return destination
+
+
+class DeliveryError(Exception):
+    # Failed delivery to a destination; the message is shown to the client
+    pass
+
+
+class Progress:
+    # Bytes sent to a destination, reported to the client with the throughput
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.start = time.perf_counter()
+
+    def info(self, destination):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+
+        return {
+            "destino": destination.label,
+            "enviados": self.sent,
+            "total": self.total,
+            "porcentaje": round(100 * self.sent / self.total, 1) if self.total else 100,
+            "bytes_por_segundo": round(self.sent / elapsed),
+        }
+
+
+class ProgressBuffer(io.BytesIO):
+    # In-memory file that updates the progress as the HTTP client reads it in chunks
+    def __init__(self, content, progress):
+        super().__init__(content)
+        self.progress = progress
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.progress.sent = self.tell()
+
+        return data
+
+
+class Destination:
+    # Base class of the destination plugins; "format" is the report file they receive and "label" the name shown to the client
+    name = None
+    label = None
+    format = None
+
+    def __init__(self, job, settings):
+        self.job = job
+        self.settings = settings
+        self.format = settings["formats"].get(self.name, self.format)
+
+    async def backoff(self, attempt):
+        # Exponential backoff with jitter before retrying a failed request or chunk
+        await asyncio.sleep(
+            self.settings["backoff_factor"] * 2**attempt * (0.5 + random.random())
+        )
+
+    async def upload(self, file, progress):
+        raise NotImplementedError
+
+
+@register
+class FastUpload(Destination):
+    name = "fastupload"
+    label = "FastUpload"
+    format = "csv"
+
+    # FastUpload base URL
+    URL = "https://api.fastupload.io/api/v2/"
+
+    async def post(self, client, url, timeout_message, connection_message, **kwargs):
+        # POST with retries on connection errors and 429/5xx responses
+        for attempt in range(self.settings["max_retries"] + 1):
+            try:
+                response = await client.post(url, **kwargs)
+            except httpx.TransportError as error:
+                if attempt == self.settings["max_retries"]:
+                    raise DeliveryError(
+                        timeout_message
+                        if isinstance(error, httpx.TimeoutException)
+                        else connection_message
+                    )
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    return response.json()
+
+                if attempt == self.settings["max_retries"]:
+                    raise DeliveryError(connection_message)
+
+            await self.backoff(attempt)
+
+    async def upload(self, file, progress):
+        timeout = httpx.Timeout(self.settings["timeout"], connect=7)
+
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            # FastUpload authentication with the account API keys
+            with self.job.stage("fastupload_auth"):
+                credentials_json = await self.post(
+                    client,
+                    f"{self.URL}authorize",
+                    "La autenticación en FastUpload excedió el tiempo de espera",
+                    "Error de conexión a FastUpload durante la autenticación",
+                    data={"key1": os.getenv("KEY_1"), "key2": os.getenv("KEY_2")},
+                )
+
+            if credentials_json["_status"] != "success":
+                raise DeliveryError("Error de autenticación en FastUpload")
+
+            # Stream the file from memory; it is read again from the start on each retry
+            with self.job.stage("fastupload_upload"):
+                confirmation_json = await self.post(
+                    client,
+                    f"{self.URL}file/upload",
+                    "La subida del informe a FastUpload excedió el tiempo de espera",
+                    "Error de conexión a FastUpload durante la subida del informe",
+                    data={
+                        "access_token": credentials_json["data"]["access_token"],
+                        "account_id": credentials_json["data"]["account_id"],
+                    },
+                    files={
+                        "upload_file": (
+                            file["name"],
+                            ProgressBuffer(file["content"], progress),
+                            file["media_type"],
+                        )
+                    },
+                )
+
+        if confirmation_json["_status"] != "success":
+            raise DeliveryError("Error al subir el informe a FastUpload")
+
+
+@register
+class GoogleDrive(Destination):
+    name = "drive"
+    label = "Google Drive"
+    format = "xlsx"
+
+    async def upload(self, file, progress):
+        # Class with methods to interact with the required drive (shared authorized session)
+        with self.job.stage("drive_auth"):
+            gdrive = await self.job.run_blocking(drive_session.get)
+
+        chunks = max(self.settings["chunk_bytes"] // DRIVE_CHUNK_MULTIPLE, 1)
+
+        # Resumable upload session; every chunk is retried with backoff by the Google API client
+        request = gdrive.auth.service.files().insert(
+            body={
+                "title": file["name"],
+                "mimeType": file["media_type"],
+                "parents": [
+                    {"kind": "drive#fileLink", "id": f"{os.getenv('UPLOAD_FOLDER_ID')}"}
+                ],
+            },
+            media_body=MediaIoBaseUpload(
+                io.BytesIO(file["content"]),
+                mimetype=file["media_type"],
+                chunksize=chunks * DRIVE_CHUNK_MULTIPLE,
+                resumable=True,
+            ),
+            supportsAllDrives=True,
+        )
+
+        # pydrive2 HTTP objects are not thread-safe, so the upload uses its own
+        http = await self.job.run_blocking(gdrive.auth.Get_Http_Object)
+        response = None
+
+        with self.job.stage("drive_upload"):
+            while response is None:
+                try:
+                    status, response = await self.job.run_blocking(
+                        request.next_chunk,
+                        http=http,
+                        num_retries=self.settings["max_retries"],
+                    )
+                except (HttpError, httplib2.HttpLib2Error, OSError):
+                    raise DeliveryError("Error al guardar el informe en Google Drive")
+
+                if status is not None:
+                    progress.sent = status.resumable_progress
+
+        progress.sent = progress.total
+
+
+@register
+class Archive(Destination):
+    # Copy of the report in a local (or mounted) archive folder, REPORT_ARCHIVE_DIR
+    name = "archive"
+    label = "Archivo"
+    format = "parquet"
+
+    def write(self, file):
+        os.makedirs(self.settings["archive_directory"], exist_ok=True)
+        path = os.path.join(self.settings["archive_directory"], file["name"])
+
+        with open(f"{path}.tmp", "wb") as archive_file:
+            archive_file.write(file["content"])
+
+        os.replace(f"{path}.tmp", path)
+
+    async def upload(self, file, progress):
+        with self.job.stage("archive_write"):
+            try:
+                await self.job.run_blocking(self.write, file)
+            except OSError:
+                raise DeliveryError("Error al guardar el informe en el archivo")
+
+        progress.sent = progress.total
+
+
+def formats(destinations=None):
+    # Report formats received by the destinations (by default, the ones in REPORT_DESTINATIONS)
+    settings = _settings()
+
+    return [
+        settings["formats"].get(name, DESTINATIONS[name].format)
+        for name in destinations or settings["destinations"]
+        if name in DESTINATIONS
+    ]
+
+
+async def _report_progress(job, destination, progress, interval):
+    # Send the progress of a destination to the client while its upload runs
+    last_sent = None
+
+    while True:
+        if progress.sent != last_sent:
+            last_sent = progress.sent
+            await job.emit("delivery_progress", progress.info(destination))
+
+        await asyncio.sleep(interval)
+
+
+async def _deliver(job, report, destination, settings):
+    file = report["files"].get(destination.format)
+
+    if file is None:
+        # The ETL run did not write the format of this destination
+        await job.emit(
+            "events_messages",
+            {
+                "status": "error",
+                "content": f'El informe no fue generado en formato "{destination.format}" para {destination.label}',
+            },
+        )
+        return False
+
+    progress = Progress(len(file["content"]))
+    reporter = asyncio.create_task(
+        _report_progress(job, destination, progress, settings["progress_interval"])
+    )
+
+    try:
+        await destination.upload(file, progress)
+    except DeliveryError as error:
+        # Emit a message to the client indicating why the delivery to this destination failed
+        await job.emit("events_messages", {"status": "error", "content": str(error)})
+        return False
+    finally:
+        reporter.cancel()
+
+    # With several workers this locks and rewrites the shared artifacts, so it runs in a worker thread
+    await job.run_blocking(artifacts.mark_delivered, report["job_id"], destination.name)
+    metrics.increment("etl_stage_bytes_total", progress.total, stage="send_report")
+    await job.emit("delivery_progress", progress.info(destination))
+
+    return True
+
+
+async def deliver(job, report, destinations=None, resend=False):
+    # Upload the report to every destination concurrently; destinations that already received it are skipped unless "resend" is set. Returns the destinations that failed
+    settings = _settings()
+    names = destinations or settings["destinations"]
+    unknown = [name for name in names if name not in DESTINATIONS]
+
+    for name in unknown:
+        await job.emit(
+            "events_messages",
+            {"status": "error", "content": f'Destino de entrega desconocido: "{name}"'},
+        )
+
+    pending = [
+        DESTINATIONS[name](job, settings)
+        for name in names
+        if name in DESTINATIONS and (resend or name not in report["delivered"])
+    ]
+    delivered = await asyncio.gather(
+        *(_deliver(job, report, destination, settings) for destination in pending)
+    )
+
+    return unknown + [
+        destination.name
+        for destination, success in zip(pending, delivered)
+        if not success
+    ]
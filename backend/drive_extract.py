@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+
+# Modules
+import shared
+
+
+# Metadata requested from Google Drive for each file in the extraction folder
+FILE_FIELDS = "items(id,title,md5Checksum,modifiedDate),nextPageToken"
+
+# Guards the manifest against concurrent jobs (and the other workers with "shared.worker_lock")
+_lock = threading.Lock()
+
+
+def _manifest_path():
+    return os.getenv("DRIVE_MANIFEST_FILE", "drive_manifest.json")
+
+
+def load_manifest():
+    # Files already processed ({id: {"title", "md5Checksum", "modifiedDate"}}) and the greatest "modifiedDate" among them
+    try:
+        with open(_manifest_path(), "r") as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"checkpoint": None, "files": {}}
+
+
+def list_files(gdrive, folder_id, modified_after=None):
+    # List the files of a folder (only the ones modified after the checkpoint, when provided), requesting just the required fields
+    query = f"'{folder_id}' in parents and trashed=false"
+
+    if modified_after is not None:
+        query += f" and modifiedDate > '{modified_after}'"
+
+    return gdrive.ListFile({"q": query, "fields": FILE_FIELDS}).GetList()
+
+
+def _changed(file, manifest):
+    processed = manifest["files"].get(file["id"])
+
+    return (
+        processed is None
+        or file.get("md5Checksum") is None
+        or processed["md5Checksum"] != file["md5Checksum"]
+    )
+
+
+def pending_files(files, manifest):
+    # Files that were never processed or whose content changed since they were processed
+    return [file for file in files if _changed(file, manifest)]
+
+
+def mark_processed(files):
+    # Add the processed files to the manifest and move the checkpoint forward
+    with _lock, shared.worker_lock("drive_manifest"):
+        manifest = load_manifest()
+
+        for file in files:
+            manifest["files"][file["id"]] = {
+                "title": file["title"],
+                "md5Checksum": file.get("md5Checksum"),
+                "modifiedDate": file.get("modifiedDate"),
+            }
+
+        # RFC 3339 dates in UTC ("...Z") are ordered as strings
+        modified_dates = [
+            file["modifiedDate"]
+            for file in manifest["files"].values()
+            if file["modifiedDate"] is not None
+        ]
+        manifest["checkpoint"] = max(modified_dates, default=None)
+
+        temporary_path = shared.temporary_name(_manifest_path())
+
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        os.replace(temporary_path, _manifest_path())
+
+
+def download(gdrive, file_id):
+    # Content of a file in memory (no temporary file in the working directory)
+    drive_file = gdrive.CreateFile({"id": file_id})
+    drive_file.FetchContent()
+
+    return drive_file.content
@@ -0,0 +1,627 @@
+# ETL-related libraries
+import httpx
+import polars as pl
+
+# Other libraries
+import os
+from datetime import date
+
+# Modules
+from google_auth import drive_session
+import simem
+import transform
+import validation
+import generators
+import metrics
+import drive_extract
+import artifacts
+import history
+import payload
+import delivery
+import excel
+import scenarios
+import results
+import report
+import portfolios
+
+
+async def start_etl(job, options=None, payload_settings=None):
+    # Several portfolios ({"portafolios": true} or a list of names): each one is read from its own extraction folder and the balance of all of them is reported together
+    if (options or {}).get("portafolios"):
+        await portfolios.start_etl(job, options, payload_settings)
+        return
+
+    print(f"Starting ETL: SID {job.sid}, job {job.id}")
+
+    # Incremental mode processes every XLSX file that changed since the last run, skipping the files already processed
+    incremental = bool(
+        (options or {}).get(
+            "incremental", os.getenv("DRIVE_INCREMENTAL", "false").lower() == "true"
+        )
+    )
+
+    # Range mode accepts capacity files spanning several days (and every XLSX file in the extraction folder); incremental runs always use it
+    range_mode = bool((options or {}).get("range", False)) or incremental
+
+    # Date to process (scheduled and command line runs): every XLSX file is read and only the capacity of that date is kept
+    fecha = (options or {}).get("fecha")
+
+    # Skip the run when the balance of every date was already saved in the history (scheduled and command line runs)
+    dedup = bool((options or {}).get("dedup", False))
+
+    # Hourly mode also prices the balance of each hour with the hourly "Precio de bolsa" and sends the hourly breakdown to the client
+    hourly = bool(
+        (options or {}).get(
+            "hourly", os.getenv("ETL_HOURLY", "false").lower() == "true"
+        )
+    )
+
+    # What-if scenarios (capacity derates and price shocks) evaluated on top of the balance, when requested
+    escenarios = (options or {}).get("escenarios")
+
+    # Report formats: the ones of the delivery destinations and ETL_REPORT_FORMATS, plus the ones requested by the client (e.g. ["parquet", "csv.zst"])
+    try:
+        formatos = report.formats(delivery.formats(), (options or {}).get("formatos"))
+    except report.ReportError as error:
+        # Emit a message to the client indicating why the formats are not valid
+        await job.emit("events_messages", {"status": "error", "content": str(error)})
+        await job.emit("stop_processing")
+        return
+
+    # Class with methods to interact with the required drive (shared authorized session)
+    try:
+        with job.stage("drive_auth"):
+            gdrive = await job.run_blocking(drive_session.get)
+    except Exception:
+        # Emit a message to the client indicating that the authentication to Google Drive failed
+        await job.emit(
+            "events_messages",
+            {"status": "error", "content": "Error de autenticación en Google Drive"},
+        )
+        await job.emit("stop_processing")
+        return
+    else:
+        # Emit a message to the client indicating that the authentication to Google Drive was successful
+        await job.emit(
+            "events_messages",
+            {"status": "success", "content": "Autenticación exitosa en Google Drive"},
+        )
+
+    # EXTRACT 1
+    # List the files in the extraction folder (in incremental mode, only the ones modified after the last processed file)
+    manifest = drive_extract.load_manifest() if incremental else None
+
+    with job.stage("extract_1_list"):
+        file_list = await job.run_blocking(
+            drive_extract.list_files,
+            gdrive,
+            os.getenv("EXTRACTION_FOLDER_ID"),
+            manifest["checkpoint"] if incremental else None,
+        )
+
+    if incremental:
+        # Keep every XLSX file that is new or whose content changed since it was processed
+        xlsx_files = drive_extract.pending_files(
+            [file for file in file_list if file["title"].endswith(".xlsx")], manifest
+        )
+
+        if len(xlsx_files) == 0:
+            # Emit a message to the client indicating that there is nothing new to process
+            await job.emit(
+                "events_messages",
+                {
+                    "status": "success",
+                    "content": "La carpeta de extracción no contiene archivos XLSX nuevos o modificados desde la última ejecución",
+                },
+            )
+            await job.emit("stop_processing")
+            return
+
+        # Emit a message to the client indicating how many XLSX files will be processed
+        await job.emit(
+            "events_messages",
+            {
+                "status": "success",
+                "content": f"La carpeta de extracción contiene {len(xlsx_files)} archivo(s) XLSX nuevo(s) o modificado(s)",
+            },
+        )
+    else:
+        # Check if at least one file exists in the extraction folder
+        if len(file_list) == 0:
+            # Emit a message to the client indicating that no file exists in the extraction folder
+            await job.emit(
+                "events_messages",
+                {
+                    "status": "error",
+                    "content": "La carpeta de extracción no contiene algún archivo",
+                },
+            )
+            await job.emit("stop_processing")
+            return
+
+        # Emit a message to the client indicating that at least one file exists in the extraction folder
+        await job.emit(
+            "events_messages",
+            {
+                "status": "success",
+                "content": "La carpeta de extracción contiene al menos un archivo",
+            },
+        )
+
+        # Get the first xlsx file in the folder (every xlsx file in range mode) or emit a message to the client indicating that no xlsx file exists in the extraction folder
+        xlsx_files = [file for file in file_list if file["title"].endswith(".xlsx")]
+
+        if len(xlsx_files) == 0:
+            await job.emit(
+                "events_messages",
+                {
+                    "status": "error",
+                    "content": "La carpeta de extracción no contiene un archivo XLSX",
+                },
+            )
+            await job.emit("stop_processing")
+            return
+
+        await job.emit(
+            "events_messages",
+            {
+                "status": "success",
+                "content": "La carpeta de extracción contiene un archivo XLSX",
+            },
+        )
+
+    if not range_mode and fecha is None:
+        xlsx_files = xlsx_files[:1]
+
+    dfs_capacidad_generacion = []
+
+    for xlsx_file in xlsx_files:
+        # Records of a file already read before (same content), from its Parquet copy
+        with job.stage("extract_1_cache"):
+            df_capacidad_generacion = await job.run_blocking(
+                excel.load, xlsx_file.get("md5Checksum")
+            )
+
+        if df_capacidad_generacion is None:
+            # Download the content of the XLSX file into memory
+            with job.stage("extract_1_download"):
+                xlsx_content = await job.run_blocking(
+                    drive_extract.download, gdrive, xlsx_file["id"]
+                )
+                metrics.increment(
+                    "etl_stage_bytes_total",
+                    xlsx_content.getbuffer().nbytes,
+                    stage="extract_1_download",
+                )
+
+            # TRANSFORM 1
+            # Read the records of the file (columns "FECHA", "CAPACIDAD (Kwh)" and "CODIGO" after the preamble), keeping the row number of each record, and save a Parquet copy for the next reads
+            with job.stage("transform_1_read_excel"):
+                df_capacidad_generacion = await job.run_blocking(
+                    excel.read_capacity, xlsx_content.getvalue()
+                )
+                await job.run_blocking(
+                    excel.store, xlsx_file.get("md5Checksum"), df_capacidad_generacion
+                )
+
+        dfs_capacidad_generacion.append(df_capacidad_generacion)
+
+    df_capacidad_generacion = pl.concat(dfs_capacidad_generacion)
+
+    if fecha is not None:
+        df_capacidad_generacion = df_capacidad_generacion.filter(
+            pl.col("column_1").dt.date() == pl.lit(str(fecha)).str.to_date(strict=False)
+        )
+
+        if df_capacidad_generacion.height == 0:
+            # Emit a message to the client indicating that there is no capacity for the requested date
+            await job.emit(
+                "events_messages",
+                {
+                    "status": "error",
+                    "content": f"Los archivos de capacidad de generación no contienen registros de la fecha {fecha}",
+                },
+            )
+            await job.emit("stop_processing")
+            return
+
+    # Power generators of interest (the registry is reloaded if its file changed)
+    registry = generators.get_registry()
+
+    # Build the scenario matrix before processing, so an invalid matrix fails early
+    if escenarios is not None:
+        try:
+            matriz_escenarios = scenarios.matriz(escenarios, registry["codigos"])
+        except scenarios.ScenarioError as error:
+            # Emit a message to the client indicating why the scenarios are not valid
+            await job.emit(
+                "events_messages", {"status": "error", "content": str(error)}
+            )
+            await job.emit("stop_processing")
+            return
+
+    # VALIDATIONS
+    # Evaluate every rule in a single pass and emit all the errors found at once
+    with job.stage("validations"):
+        errores = await job.run_blocking(
+            validation.validar,
+            df_capacidad_generacion,
+            validation.reglas_capacidad(
+                generadores=registry["dtype"],
+                filas_esperadas=None if range_mode else registry["filas_esperadas"],
+                fecha_unica=not range_mode,
+            ),
+        )
+
+    if len(errores) > 0:
+        # Emit a message to the client with every error found in "capacidad de generación" file
+        await job.emit("events_messages", errores)
+        await job.emit("stop_processing")
+        return
+
+    with job.stage("transform_1"):
+        df_capacidad_generacion = await job.run_blocking(
+            transform.collect,
+            transform.capacidad_generacion(
+                df_capacidad_generacion.lazy(), registry["dtype"]
+            ),
+        )
+        metrics.increment(
+            "etl_stage_rows_total", df_capacidad_generacion.height, stage="transform_1"
+        )
+
+    if dedup and await job.run_blocking(
+        history.contains, df_capacidad_generacion["Fecha"].unique()
+    ):
+        # Emit a message to the client indicating that the balance of these dates was already calculated
+        await job.emit(
+            "events_messages",
+            {
+                "status": "success",
+                "content": "El balance de energía de estas fechas ya fue calculado",
+            },
+        )
+        await job.emit("stop_processing")
+        return
+
+    # Save the query dates to be used in requests to SIMEM API
+    start_date = df_capacidad_generacion.select(pl.col("Fecha")).min().item()
+    end_date = df_capacidad_generacion.select(pl.col("Fecha")).max().item()
+
+    # Emit a message to the client indicating that "capacidad de generación" file was loaded and transformed successfully
+    await job.emit(
+        "events_messages",
+        {
+            "status": "success",
+            "content": "El archivo de capacidad de generación fue cargado y transformado exitosamente",
+        },
+    )
+
+    # EXTRACT 2 AND 3
+    # Get "Despacho programado recursos de generación" and "Precio de bolsa ponderado" (and "Precio de bolsa horario" in hourly mode) from SIMEM API concurrently (or from the local cache), decoding each response as it arrives into the fields used, only for the power generators of interest
+    datasets = [
+        (simem.DESPACHO_PROGRAMADO, "Despacho programado recursos de generación"),
+        (simem.PRECIO_BOLSA, "Precio de bolsa ponderado"),
+    ]
+
+    if hourly:
+        datasets.append((simem.PRECIO_BOLSA_HORARIO, "Precio de bolsa horario"))
+
+    with job.stage("extract_2_3"):
+        simem_records = await simem.fetch_datasets(
+            [dataset_id for dataset_id, _ in datasets],
+            start_date,
+            end_date,
+            plantas=registry["codigos"],
+        )
+
+    for dataset_id, dataset_name in datasets:
+        error = simem_records[dataset_id]
+
+        if isinstance(error, httpx.TimeoutException):
+            # Emit a message to the client indicating that the request to SIMEM API timed out
+            await job.emit(
+                "events_messages",
+                {
+                    "status": "error",
+                    "content": f'La solicitud del "{dataset_name}" a la API del SIMEM excedió el tiempo de espera',
+                },
+            )
+            await job.emit("stop_processing")
+            return
+        elif isinstance(error, httpx.HTTPError):
+            # Emit a message to the client indicating that a connection error occurred with SIMEM API
+            await job.emit(
+                "events_messages",
+                {
+                    "status": "error",
+                    "content": f'Error de conexión a la API del SIMEM al solicitar el "{dataset_name}"',
+                },
+            )
+            await job.emit("stop_processing")
+            return
+        elif isinstance(error, Exception):
+            raise error
+
+    for dataset_id, _ in datasets:
+        metrics.increment(
+            "etl_stage_rows_total",
+            simem_records[dataset_id].height,
+            stage="extract_2_3",
+        )
+
+    # TRANSFORM 2
+    # Lazy plan over the records of "Despacho programado recursos de generación"
+    lf_despacho_programado = transform.despacho_programado(
+        simem_records[simem.DESPACHO_PROGRAMADO].lazy(),
+        registry["dtype"],
+    )
+
+    # Emit a message to the client indicating that "Despacho programado recursos de generación" file was loaded and transformed successfully
+    await job.emit(
+        "events_messages",
+        {
+            "status": "success",
+            "content": 'El archivo "Despacho programado recursos de generación" fue cargado y transformado exitosamente',
+        },
+    )
+
+    # TRANSFORM 3
+    # Lazy plan over the records of "Precio de bolsa ponderado"
+    lf_precio_bolsa = transform.precio_bolsa(simem_records[simem.PRECIO_BOLSA].lazy())
+
+    # Emit a message to the client indicating that "Precio de bolsa ponderado" file was loaded and transformed successfully
+    await job.emit(
+        "events_messages",
+        {
+            "status": "success",
+            "content": 'El archivo "Precio de bolsa ponderado" fue cargado y transformado exitosamente',
+        },
+    )
+
+    # Lazy plan over the records of "Precio de bolsa horario" (hourly mode only)
+    lf_precio_bolsa_horario = (
+        transform.precio_bolsa_horario(simem_records[simem.PRECIO_BOLSA_HORARIO].lazy())
+        if hourly
+        else None
+    )
+
+    # Fingerprint of every input of the result: capacity files (by checksum), options, power generators of interest and versions of the SIMEM data; runs with the same fingerprint share a single result
+    clave_resultado = results.fingerprint(
+        {
+            "capacidad": [xlsx_file.get("md5Checksum") for xlsx_file in xlsx_files],
+            "fecha": fecha,
+            "range": range_mode,
+            "hourly": hourly,
+            "escenarios": escenarios,
+            "generadores": [registry["codigos"], registry["horas_por_dia"]],
+            "simem": {
+                dataset_id: results.dataset_version(simem_records[dataset_id])
+                for dataset_id, _ in datasets
+            },
+        }
+        if all(xlsx_file.get("md5Checksum") for xlsx_file in xlsx_files)
+        else None
+    )
+
+    # Result of an identical run (stored, or in progress for another client), or None when this job computes it
+    with job.stage("load_results_cache"):
+        resultado = await results.acquire(
+            clave_resultado,
+            lambda clave: job.run_blocking(results.load, clave),
+        )
+
+    metrics.increment(
+        "etl_results_cache_total",
+        result="miss" if resultado is None else "hit",
+    )
+    calculado = resultado is None
+
+    try:
+        if calculado:
+            # TRANSFORM 4
+            # Collect the hourly join once and build the daily and hourly balance on top of it, collecting both at once
+            with job.stage("transform_2_4"):
+                df_balance_horario = await job.run_blocking(
+                    transform.collect,
+                    transform.balance_horario(
+                        df_capacidad_generacion.lazy(), lf_despacho_programado
+                    ),
+                )
+
+                lfs_balance = [
+                    transform.balance_energia(
+                        df_balance_horario.lazy(), lf_precio_bolsa
+                    ),
+                    transform.balance_energia_horario(
+                        df_balance_horario.lazy(), lf_precio_bolsa_horario
+                    ),
+                ]
+
+                # Totals of each power generator for the scenarios, from the same hourly join
+                if escenarios is not None:
+                    lfs_balance.append(
+                        transform.totales_escenarios(
+                            df_balance_horario.lazy(), lf_precio_bolsa
+                        )
+                    )
+
+                (
+                    df_balance_energia_consolidado_final,
+                    df_balance_energia_horario,
+                    *df_totales,
+                ) = await job.run_blocking(transform.collect_all, lfs_balance)
+                metrics.increment(
+                    "etl_stage_rows_total",
+                    df_balance_energia_consolidado_final.height,
+                    stage="transform_2_4",
+                )
+
+            resultado = {
+                "frames": {
+                    "consolidado": df_balance_energia_consolidado_final,
+                    "horario": df_balance_energia_horario,
+                },
+                "files": {},
+                "messages": {},
+            }
+
+        # Emit a message to the client indicating that "balance de energía" report was calculated successfully
+        await job.emit(
+            "events_messages",
+            {
+                "status": "success",
+                "content": "El balance de energía fue calculado exitosamente",
+            },
+        )
+        await job.emit("stop_processing")
+
+        with job.stage("load_json"):
+            balance_energia_messages = await job.run_blocking(
+                results.messages, resultado, "consolidado", payload_settings
+            )
+
+        # LOAD
+        # Emit "balance de energía" report to the client, encoded as the client negotiated (row-oriented JSON by default)
+        for message in balance_energia_messages:
+            await job.emit("energy_balance", message)
+
+        # Emit the hourly breakdown of the balance (priced by hour) to the client in hourly mode
+        if hourly:
+            with job.stage("load_json"):
+                balance_energia_horario_messages = await job.run_blocking(
+                    results.messages, resultado, "horario", payload_settings
+                )
+
+            for message in balance_energia_horario_messages:
+                await job.emit("energy_balance_hourly", message)
+
+        # Emit the distribution of the balance and COP exposure of each power generator across the scenarios
+        if escenarios is not None:
+            if calculado:
+                with job.stage("transform_scenarios"):
+                    resultado["frames"]["escenarios"] = await job.run_blocking(
+                        scenarios.evaluar, df_totales[0], matriz_escenarios
+                    )
+
+            with job.stage("load_json"):
+                escenarios_messages = await job.run_blocking(
+                    results.messages, resultado, "escenarios", payload_settings
+                )
+
+            for message in escenarios_messages:
+                await job.emit("energy_balance_scenarios", message)
+
+        # Serialize "balance de energía" report in memory in every format not written yet (a stored result may lack a format requested now), all of them at once
+        formatos_faltantes = [
+            formato for formato in formatos if formato not in resultado["files"]
+        ]
+
+        if len(formatos_faltantes) > 0:
+            with job.stage("load_files"):
+                report_files = await report.write(
+                    job, resultado["frames"]["consolidado"], formatos_faltantes
+                )
+                resultado["files"].update(report_files)
+
+            metrics.increment(
+                "etl_stage_bytes_total",
+                payload.size(balance_energia_messages)
+                + sum(len(file["content"]) for file in report_files.values()),
+                stage="load_files",
+            )
+
+        if calculado:
+            # Keep the result for the next runs with the same inputs
+            with job.stage("load_results_cache"):
+                await job.run_blocking(results.store, clave_resultado, resultado)
+
+            # Append the consolidated and hourly balance to the history store (a stored result was already appended by the run that computed it)
+            with job.stage("load_history"):
+                await job.run_blocking(
+                    history.append,
+                    job.id,
+                    {
+                        "consolidado": resultado["frames"]["consolidado"],
+                        "horario": resultado["frames"]["horario"],
+                    },
+                )
+    finally:
+        # Hand the result to the identical runs waiting for it (or let them compute it if this run failed)
+        if calculado:
+            results.release(
+                clave_resultado, resultado if resultado and resultado["files"] else None
+            )
+
+    # Keep the report files for the report delivery, named after the job that produced them
+    await job.run_blocking(
+        artifacts.save,
+        job,
+        {
+            file_format: {
+                "name": f"balance_energia_{date.today()}_{job.id}.{file_format}",
+                **file,
+            }
+            for file_format, file in resultado["files"].items()
+        },
+    )
+
+    # Save the processed files in the manifest so the next incremental run skips them
+    if incremental:
+        await job.run_blocking(drive_extract.mark_processed, xlsx_files)
+
+    # Emit the duration of each stage to the client when requested
+    if (options or {}).get("timings", False):
+        await job.emit("etl_timings", job.timings)
+
+    print(f"Finished ETL: SID {job.sid}, job {job.id}")
+
+
+async def send_report(job, options=None):
+    print(f"Sending report: SID {job.sid}, job {job.id}")
+
+    # Report outputs of the requested ETL job (by default, the last one requested by the client)
+    job_id = (options or {}).get("job_id")
+    report = (
+        await job.run_blocking(artifacts.get, job_id)
+        if job_id
+        else await job.run_blocking(artifacts.latest, job.sid)
+    )
+
+    if report is None:
+        # Emit a message to the client indicating that there is no report to send
+        await job.emit(
+            "events_messages",
+            {
+                "status": "error",
+                "content": "No hay un informe generado para enviar",
+            },
+        )
+        await job.emit("stop_processing")
+        return
+
+    # UPLOAD THE REPORT
+    # Upload the report to every configured destination concurrently (FastUpload and Google Drive by default), skipping the destinations that already received it
+    failed = await delivery.deliver(
+        job,
+        report,
+        (options or {}).get("destinos"),
+        resend=bool((options or {}).get("reenviar", False)),
+    )
+
+    if len(failed) == 0:
+        await job.emit(
+            "events_messages",
+            {
+                "status": "success",
+                "content": "Informe enviado y guardado existosamente",
+            },
+        )
+
+    await job.emit("stop_processing")
+
+    # Emit the duration of each stage to the client when requested
+    if (options or {}).get("timings", False):
+        await job.emit("etl_timings", job.timings)
+
+    print(f"Report sent: SID {job.sid}, job {job.id}")
@@ -0,0 +1,139 @@
+import os
+import threading
+
+import fastexcel
+import polars as pl
+
+# Modules
+import shared
+
+
+# Layout of the "capacidad de generación" workbook: preamble rows before the records, and positions of the "FECHA", "CAPACIDAD (Kwh)" and "CODIGO" columns ("PLANTA" and "GENERADOR" are not read)
+PREAMBLE_ROWS = 4
+COLUMNS = [0, 3, 4]
+
+# Types of the "FECHA", "CAPACIDAD (Kwh)" and "CODIGO" cells read by fastexcel; cells of another type (e.g. dates and numbers saved as text) are read as null and read again as text
+DTYPES = {0: "datetime", 3: "float", 4: "string"}
+TEXT_DTYPES = {column: "string" for column in COLUMNS}
+
+# Increase when the way workbooks are read changes, so cached copies are converted again
+CACHE_VERSION = 2
+
+# Guards the removal of the least recently used copies against concurrent jobs (and the other workers with "shared.worker_lock")
+_lock = threading.Lock()
+
+
+def _settings():
+    return {
+        "enabled": os.getenv("EXCEL_CACHE_ENABLED", "true").lower() == "true",
+        "directory": os.getenv("EXCEL_CACHE_DIR", "excel_cache"),
+        "max_files": int(os.getenv("EXCEL_CACHE_MAX_FILES", "100")),
+    }
+
+
+def _load_sheet(reader, dtypes):
+    df = reader.load_sheet(
+        0,
+        header_row=None,
+        skip_rows=PREAMBLE_ROWS,
+        use_columns=COLUMNS,
+        dtypes=dtypes,
+    ).to_polars()
+    df.columns = ["column_1", "column_2", "column_3"]
+
+    return df
+
+
+def _text_cells(df, df_text):
+    # Dates and numbers saved as text ("YYYY-MM-DD HH:MM..." and decimal numbers) are parsed from the text of the cells; the text of the cells that are still not valid is kept in "column_1_texto" and "column_2_texto" for the validations
+    fecha_hora = (
+        df_text["column_1"]
+        .str.slice(offset=0, length=16)
+        .str.to_datetime("%Y-%m-%d %H:%M", time_unit="ms", strict=False)
+    )
+    capacidad = df_text["column_2"].str.strip_chars().cast(pl.Float64, strict=False)
+
+    df = df.with_columns(
+        pl.col("column_1").fill_null(fecha_hora),
+        pl.col("column_2").fill_null(capacidad),
+    )
+
+    return df.with_columns(
+        pl.when(pl.col("column_1").is_null())
+        .then(df_text["column_1"])
+        .alias("column_1_texto"),
+        pl.when(pl.col("column_2").is_null())
+        .then(df_text["column_2"])
+        .alias("column_2_texto"),
+    )
+
+
+def read_capacity(content):
+    # Read only the required columns of the first sheet, skipping the preamble, with the type of each column (native datetime and float cells), and keep the row number of each record in the sheet. The sheet is read again as text only when a cell does not have the type of its column
+    reader = fastexcel.read_excel(content)
+    df = _load_sheet(reader, DTYPES)
+
+    if df["column_1"].null_count() > 0 or df["column_2"].null_count() > 0:
+        df = _text_cells(df, _load_sheet(reader, TEXT_DTYPES))
+    else:
+        df = df.with_columns(
+            pl.lit(None, pl.String).alias("column_1_texto"),
+            pl.lit(None, pl.String).alias("column_2_texto"),
+        )
+
+    # Empty rows are ignored
+    return df.with_row_index("Fila", offset=PREAMBLE_ROWS + 1).filter(
+        ~pl.all_horizontal(pl.all().exclude("Fila").is_null())
+    )
+
+
+def _cache_path(settings, checksum):
+    return os.path.join(settings["directory"], f"{checksum}_v{CACHE_VERSION}.parquet")
+
+
+def load(checksum):
+    # Records of a workbook already read, by the MD5 checksum of its content (None when it was never read)
+    settings = _settings()
+
+    if not settings["enabled"] or checksum is None:
+        return None
+
+    path = _cache_path(settings, checksum)
+
+    try:
+        df = pl.read_parquet(path)
+
+        # The modification time tracks the last use of each copy
+        os.utime(path)
+    except FileNotFoundError:
+        # Never read, or removed by another job while it was read
+        return None
+
+    return df
+
+
+def store(checksum, df):
+    # Save a Parquet copy of the records of a workbook, removing the least recently used copies beyond the limit
+    settings = _settings()
+
+    if not settings["enabled"] or checksum is None:
+        return
+
+    os.makedirs(settings["directory"], exist_ok=True)
+    path = _cache_path(settings, checksum)
+    temporary_path = shared.temporary_name(path)
+    df.write_parquet(temporary_path)
+    os.replace(temporary_path, path)
+
+    with _lock, shared.worker_lock("excel_cache"):
+        copies = sorted(
+            (
+                os.path.join(settings["directory"], file_name)
+                for file_name in os.listdir(settings["directory"])
+                if file_name.endswith(".parquet")
+            ),
+            key=os.path.getmtime,
+        )
+
+        for copy in copies[: max(0, len(copies) - settings["max_files"])]:
+            os.remove(copy)
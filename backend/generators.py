@@ -0,0 +1,79 @@
+import os
+import re
+import threading
+import tomllib
+
+import polars as pl
+
+
+# Registry of the power generators of interest, loaded from GENERADORES_FILE and reloaded whenever the file changes
+_registry = None
+_lock = threading.Lock()
+
+# Portfolio names are also the names of their directories in the history store
+NOMBRE_PORTAFOLIO = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def _path():
+    return os.getenv("GENERADORES_FILE", "generadores.toml")
+
+
+def _portafolio(nombre, config, horas_por_dia):
+    # Power generators and extraction folder of a portfolio (business unit), processed in the multi-portfolio mode
+    if not NOMBRE_PORTAFOLIO.fullmatch(nombre):
+        raise ValueError(
+            f"Invalid portfolio name {nombre!r}: only letters, digits, '_' and '-'"
+        )
+
+    codigos = sorted(set(config["generadores"]))
+
+    return {
+        "codigos": codigos,
+        "dtype": pl.Enum(codigos),
+        "filas_esperadas": len(codigos) * horas_por_dia,
+        "carpeta_extraccion": config["carpeta_extraccion"],
+    }
+
+
+def _load(path):
+    with open(path, "rb") as config_file:
+        config = tomllib.load(config_file)
+
+    # Categories are sorted so the Enum order matches the alphabetical order of the codes
+    codigos = sorted(set(config["generadores"]))
+    horas_por_dia = config.get("horas_por_dia", 24)
+
+    return {
+        "codigos": codigos,
+        "dtype": pl.Enum(codigos),
+        "horas_por_dia": horas_por_dia,
+        "filas_esperadas": len(codigos) * horas_por_dia,
+        "portafolios": {
+            nombre: _portafolio(nombre, portafolio, horas_por_dia)
+            for nombre, portafolio in sorted(config.get("portafolios", {}).items())
+        },
+        "mtime": os.stat(path).st_mtime,
+    }
+
+
+def get_registry():
+    # Current registry, reloading it when the configuration file was modified
+    global _registry
+
+    path = _path()
+
+    with _lock:
+        if _registry is None or os.stat(path).st_mtime != _registry["mtime"]:
+            _registry = _load(path)
+
+        return _registry
+
+
+def reload_registry():
+    # Force a reload of the configuration file
+    global _registry
+
+    with _lock:
+        _registry = _load(_path())
+
+        return _registry
@@ -1,13 +1,22 @@
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
 
+import asyncio
+import os
+import threading
+from datetime import datetime
+
+
+# File where the OAuth 2.0 credentials are saved
+CREDENTIALS_FILE = "./credential_module.json"
+
 
 def gauth():
     # GoogleAuth() returns a class that contains Google authentication and authorization related properties and methods using OAuth 2.0
     gauth = GoogleAuth()
 
     # Try to load saved client credentials (if available)
-    gauth.LoadCredentialsFile("./credential_module.json")
+    gauth.LoadCredentialsFile(CREDENTIALS_FILE)
 
     if gauth.credentials is None:
         try:
@@ -16,9 +25,72 @@ def gauth():
             raise Exception("Authentication failed")
     elif gauth.access_token_expired:
         gauth.Refresh()
-        gauth.SaveCredentialsFile("./credential_module.json")
+        gauth.SaveCredentialsFile(CREDENTIALS_FILE)
     else:
         gauth.Authorize()
 
     # GoogleDrive() returns a class with methods to interact with the drive associated to the provided credentials
     return GoogleDrive(gauth)
+
+
+class DriveSession:
+    # Long-lived authorized Google Drive client shared by every job. pydrive2 gives each thread its own HTTP object, so the client can be used from several worker threads at once
+    def __init__(self, connect=gauth):
+        self.connect = connect
+        self._drive = None
+        self._lock = threading.Lock()
+
+    def _seconds_to_expiry(self):
+        credentials = getattr(getattr(self._drive, "auth", None), "credentials", None)
+
+        if credentials is None or credentials.token_expiry is None:
+            return None
+
+        return (credentials.token_expiry - datetime.utcnow()).total_seconds()
+
+    def _refresh(self):
+        self._drive.auth.Refresh()
+        self._drive.auth.SaveCredentialsFile(CREDENTIALS_FILE)
+
+    def get(self):
+        # Authorized client; authenticates on first use and refreshes the token if it already expired
+        with self._lock:
+            if self._drive is None:
+                self._drive = self.connect()
+            elif (seconds := self._seconds_to_expiry()) is not None and seconds <= 0:
+                self._refresh()
+
+            return self._drive
+
+    def refresh_if_needed(self, margin):
+        # Refresh the token when it expires in less than "margin" seconds
+        with self._lock:
+            if self._drive is None:
+                return
+
+            seconds = self._seconds_to_expiry()
+
+            if seconds is not None and seconds < margin:
+                self._refresh()
+
+    def reset(self):
+        # Forget the client so the next use authenticates again
+        with self._lock:
+            self._drive = None
+
+    async def keep_alive(self):
+        # Background task that refreshes the token before it expires
+        interval = int(os.getenv("DRIVE_REFRESH_CHECK_SECONDS", "60"))
+        margin = int(os.getenv("DRIVE_REFRESH_MARGIN_SECONDS", "300"))
+
+        while True:
+            await asyncio.sleep(interval)
+
+            try:
+                await asyncio.to_thread(self.refresh_if_needed, margin)
+            except Exception as error:
+                print(f"Google Drive token refresh failed: {error}")
+
+
+# Google Drive session shared by the whole application
+drive_session = DriveSession()
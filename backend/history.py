@@ -0,0 +1,177 @@
+import os
+from datetime import datetime
+
+import polars as pl
+
+
+# Tables of the history store: balance by date and power generator, and by hour
+TABLAS = ("consolidado", "horario")
+
+
+def _settings():
+    return {
+        "enabled": os.getenv("HISTORY_ENABLED", "true").lower() == "true",
+        "directory": os.getenv("HISTORY_DIR", "historial"),
+    }
+
+
+# Columns identifying a row of each table, so the rows of a date saved by several runs are merged ("Portafolio" is added when a run of a portfolio was saved, since a power generator may belong to several portfolios)
+CLAVES = {"consolidado": ["Fecha", "Codigo"], "horario": ["Fecha", "Codigo", "Hora"]}
+
+
+def _partition_directory(settings, tabla, fecha, portafolio=None):
+    # Runs of a portfolio are saved in a subdirectory of each date ("<tabla>/<fecha>/<portafolio>/"), so they do not supersede the runs of the other portfolios (nor the runs of the whole extraction folder)
+    return os.path.join(
+        settings["directory"], tabla, str(fecha), *([portafolio] if portafolio else [])
+    )
+
+
+def append(job_id, frames, portafolio=None):
+    # Append the results of a run ({tabla: DataFrame}), one Parquet file per table and date; files are never rewritten, a later run of the same date (and portfolio) supersedes the previous ones
+    settings = _settings()
+
+    if not settings["enabled"]:
+        return
+
+    # File names start with the run timestamp so the latest file of each date sorts last
+    file_name = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}_{job_id}.parquet"
+
+    for tabla, df in frames.items():
+        for (fecha,), df_fecha in df.partition_by("Fecha", as_dict=True).items():
+            directory = _partition_directory(settings, tabla, fecha, portafolio)
+            os.makedirs(directory, exist_ok=True)
+
+            # Write atomically so a query never reads a half written file
+            temporary_path = os.path.join(directory, f".{file_name}.tmp")
+            df_fecha.write_parquet(temporary_path)
+            os.replace(temporary_path, os.path.join(directory, file_name))
+
+
+def _latest_file(directory):
+    parquet_files = sorted(
+        file_name
+        for file_name in os.listdir(directory)
+        if file_name.endswith(".parquet")
+    )
+
+    return os.path.join(directory, parquet_files[-1]) if parquet_files else None
+
+
+def _latest_files(settings, tabla, desde, hasta):
+    # Partition pruning: only the latest file of each date within the range is scanned (and the latest one of each portfolio of the date)
+    directory = os.path.join(settings["directory"], tabla)
+
+    try:
+        fechas = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+
+    files = []
+
+    for fecha in fechas:
+        # Dates in ISO format are ordered as strings
+        if (desde is not None and fecha < str(desde)) or (
+            hasta is not None and fecha > str(hasta)
+        ):
+            continue
+
+        fecha_directory = os.path.join(directory, fecha)
+        latest_files = [
+            _latest_file(fecha_directory),
+            *(
+                _latest_file(entry.path)
+                for entry in os.scandir(fecha_directory)
+                if entry.is_dir()
+            ),
+        ]
+        files.extend(file for file in latest_files if file is not None)
+
+    # File names start with the run timestamp: oldest run first
+    return sorted(files, key=os.path.basename)
+
+
+def contains(fechas, portafolios=None):
+    # Whether the consolidated balance of every date was already saved (by a run of the whole extraction folder, or by a run of each of the portfolios)
+    settings = _settings()
+
+    for fecha in fechas:
+        for portafolio in portafolios or [None]:
+            directory = _partition_directory(settings, "consolidado", fecha, portafolio)
+
+            if not os.path.isdir(directory) or not any(
+                file_name.endswith(".parquet") for file_name in os.listdir(directory)
+            ):
+                return False
+
+    return True
+
+
+def _claves(lf, tabla):
+    return [
+        *(["Portafolio"] if "Portafolio" in lf.collect_schema().names() else []),
+        *CLAVES[tabla],
+    ]
+
+
+def scan(tabla, desde=None, hasta=None, codigos=None, operacion=None):
+    # Lazy query over the history of a table, filtered by date range, power generators and operation
+    files = _latest_files(_settings(), tabla, desde, hasta)
+
+    if len(files) == 0:
+        return None
+
+    # Runs with and without hourly prices (or a portfolio) store different columns; missing columns are read as null. A power generator saved by several runs of a date keeps the row of the latest one (of each portfolio)
+    lf = pl.concat(
+        [pl.scan_parquet(file, hive_partitioning=False) for file in files],
+        how="diagonal_relaxed",
+    )
+    lf = lf.unique(subset=_claves(lf, tabla), keep="last", maintain_order=True)
+
+    if codigos:
+        lf = lf.filter(pl.col("Codigo").is_in(codigos))
+
+    if operacion is not None:
+        lf = lf.filter(pl.col("Operacion") == operacion)
+
+    return lf
+
+
+def balance(tabla, desde=None, hasta=None, codigos=None, operacion=None):
+    lf = scan(tabla, desde, hasta, codigos, operacion)
+
+    if lf is None:
+        return pl.DataFrame()
+
+    orden = ["Fecha", "Codigo", "Hora"] if tabla == "horario" else ["Fecha", "Codigo"]
+
+    if "Portafolio" in lf.collect_schema().names():
+        orden.append("Portafolio")
+
+    return lf.sort(orden, nulls_last=True).collect()
+
+
+def resumen(desde=None, hasta=None, codigos=None, operacion=None):
+    # Totals by power generator (energy balance, COP exposure and number of days) over the consolidated history, and by portfolio when runs of portfolios were saved
+    lf = scan("consolidado", desde, hasta, codigos, operacion)
+
+    if lf is None:
+        return pl.DataFrame()
+
+    grupos = (
+        ["Portafolio", "Codigo"]
+        if "Portafolio" in lf.collect_schema().names()
+        else ["Codigo"]
+    )
+
+    return (
+        lf.group_by(grupos)
+        .agg(
+            pl.col("Fecha").min().alias("Desde"),
+            pl.col("Fecha").max().alias("Hasta"),
+            pl.len().alias("Dias"),
+            pl.sum("Balance (kWh)"),
+            pl.sum("Compromisos (COP)"),
+        )
+        .sort(grupos, nulls_last=True)
+        .collect()
+    )
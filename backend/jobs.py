@@ -0,0 +1,198 @@
+import asyncio
+import functools
+import os
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Modules
+import metrics
+import profiling
+import shared
+
+
+class Job:
+    # Unit of work (ETL run or report delivery) requested by a client
+    def __init__(self, kind, sid, emit, executor, profile=False):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.sid = sid
+        self.status = "en_cola"
+        self.created_at = datetime.now()
+        self.task = None
+        self.timings = {}
+        self._emit = emit
+        self._executor = executor
+        # CPU and allocation profile of the job, only when requested (allocations are traced in the whole process while it runs)
+        self.profiler = profiling.Profiler(self.id) if profile else None
+
+    async def emit(self, event, data=None):
+        # Only the client that requested the job receives its messages
+        await self._emit(event, data, to=self.sid)
+
+    async def run_blocking(self, function, *args, **kwargs):
+        # Run a blocking stage in the worker pool so the event loop keeps serving other clients
+        loop = asyncio.get_running_loop()
+
+        if self.profiler is not None:
+            function = self.profiler.traced(function)
+
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+
+    def stage(self, name):
+        # Time a stage of the job (Prometheus histogram and per run summary), also measuring its allocations when the job is profiled
+        timer = metrics.stage(name, self.timings)
+
+        return timer if self.profiler is None else self.profiler.stage(name, timer)
+
+    def info(self):
+        return {
+            "job_id": self.id,
+            "tipo": self.kind,
+            "estado": self.status,
+            "creado": self.created_at.isoformat(timespec="seconds"),
+        }
+
+    async def report_status(self):
+        # Send the state of the job to the client and, with several workers, save it in the shared directory so any worker answers "job_status"
+        if shared.directory() is not None:
+            await asyncio.to_thread(
+                shared.write_json,
+                shared.path("jobs", f"{self.id}.json"),
+                {**self.info(), "sid": self.sid},
+            )
+
+        await self.emit("job_status", self.info())
+
+    async def save_profile(self):
+        # Save the profile files and send their download routes to the client
+        await asyncio.to_thread(self.profiler.stop)
+        await self.emit(
+            "job_profile",
+            {
+                "job_id": self.id,
+                "muestras": self.profiler.samples,
+                **{kind: f"/perfiles/{self.id}/{kind}" for kind in profiling.FILES},
+            },
+        )
+
+
+class JobManager:
+    # Queue of jobs executed with a bounded number of concurrent jobs and worker threads
+    def __init__(self, emit, max_concurrent_jobs=None):
+        self.emit = emit
+        self.jobs = {}
+        self.history_size = int(os.getenv("ETL_JOB_HISTORY", "100"))
+        self.semaphore = asyncio.Semaphore(
+            max_concurrent_jobs or int(os.getenv("ETL_MAX_CONCURRENT_JOBS", "2"))
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("ETL_MAX_WORKERS", "4")),
+            thread_name_prefix="etl",
+        )
+
+    def submit(self, kind, sid, function, *args, profile=False):
+        # Enqueue a job; "function" is a coroutine function that receives the job as its first argument
+        job = Job(kind, sid, self.emit, self.executor, profile)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job, function, *args))
+
+        self._forget_finished_jobs()
+
+        return job
+
+    async def _run(self, job, function, *args):
+        await job.report_status()
+
+        try:
+            async with self.semaphore:
+                job.status = "en_ejecucion"
+                await job.report_status()
+                start = time.perf_counter()
+
+                if job.profiler is not None:
+                    job.profiler.start()
+
+                try:
+                    await function(job, *args)
+                finally:
+                    if job.profiler is not None:
+                        await job.save_profile()
+        except asyncio.CancelledError:
+            job.status = "cancelado"
+            await job.emit(
+                "events_messages",
+                {"status": "error", "content": "El proceso fue cancelado"},
+            )
+            await job.emit("stop_processing")
+        except Exception:
+            job.status = "error"
+            traceback.print_exc()
+            await job.emit(
+                "events_messages",
+                {"status": "error", "content": "Error inesperado durante el proceso"},
+            )
+            await job.emit("stop_processing")
+        else:
+            job.status = "finalizado"
+            metrics.observe(
+                "etl_job_duration_seconds", time.perf_counter() - start, kind=job.kind
+            )
+
+        metrics.increment("etl_jobs_total", kind=job.kind, status=job.status)
+        await job.report_status()
+
+    def get(self, job_id, sid):
+        # Jobs are only visible to the client that requested them
+        job = self.jobs.get(job_id)
+
+        return job if job is not None and job.sid == sid else None
+
+    def status(self, job_id, sid):
+        # State of a job of the client, also when another worker runs it (None when it does not exist)
+        job = self.get(job_id, sid)
+
+        if job is not None:
+            return job.info()
+
+        if shared.directory() is None or not str(job_id).isalnum():
+            return None
+
+        info = shared.read_json(shared.path("jobs", f"{job_id}.json"))
+
+        if info is None or info.pop("sid") != sid:
+            return None
+
+        return info
+
+    def cancel(self, job_id, sid):
+        job = self.get(job_id, sid)
+
+        if job is None or job.task.done():
+            return False
+
+        job.task.cancel()
+
+        return True
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.task.done()]
+
+        for job_id in finished[: max(0, len(self.jobs) - self.history_size)]:
+            del self.jobs[job_id]
+
+            if shared.directory() is not None:
+                try:
+                    os.remove(shared.path("jobs", f"{job_id}.json"))
+                except FileNotFoundError:
+                    pass
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            job.task.cancel()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import pickle
+import struct
+from urllib.parse import urlparse
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+
+# Length prefix of each message sent between workers by the local socket stand-in
+HEADER = struct.Struct("!I")
+
+
+class LocalSocketManager(AsyncPubSubManager):
+    # Message queue stand-in for several workers on the same host (development and tests), without a broker: every worker listens on a Unix socket inside the directory of the URL ("local:///tmp/balance_energia_socketio") and publishes each message to the sockets of the other workers
+    name = "localsocket"
+
+    def __init__(self, url, channel="socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.directory = os.path.join(urlparse(url).path, channel)
+        self.path = os.path.join(self.directory, f"{self.host_id}.sock")
+        self.peers = {}
+
+    async def _publish(self, data):
+        message = pickle.dumps(data)
+
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+
+            if path == self.path or not file_name.endswith(".sock"):
+                continue
+
+            try:
+                if path not in self.peers:
+                    _, self.peers[path] = await asyncio.open_unix_connection(path)
+
+                self.peers[path].write(HEADER.pack(len(message)) + message)
+                await self.peers[path].drain()
+            except ConnectionRefusedError:
+                # Socket of a worker that exited
+                self.peers.pop(path, None)
+                os.remove(path)
+            except OSError:
+                self.peers.pop(path, None)
+
+    async def _listen(self):
+        messages = asyncio.Queue()
+
+        async def receive(reader, writer):
+            # Messages of another worker until it disconnects (or this worker stops listening)
+            try:
+                while True:
+                    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    await messages.put(pickle.loads(await reader.readexactly(size)))
+            except (
+                asyncio.IncompleteReadError,
+                ConnectionError,
+                asyncio.CancelledError,
+            ):
+                pass
+            finally:
+                writer.close()
+
+        os.makedirs(self.directory, exist_ok=True)
+        server = await asyncio.start_unix_server(receive, path=self.path)
+
+        try:
+            while True:
+                yield await messages.get()
+        finally:
+            server.close()
+            os.remove(self.path)
+
+
+# Client managers by scheme of the SOCKETIO_MESSAGE_QUEUE URL
+CLIENT_MANAGERS = {
+    "redis": socketio.AsyncRedisManager,
+    "rediss": socketio.AsyncRedisManager,
+    "amqp": socketio.AsyncAioPikaManager,
+    "amqps": socketio.AsyncAioPikaManager,
+    "local": LocalSocketManager,
+}
+
+
+def client_manager():
+    # Socket.IO client manager that fans out the events of every worker through the message queue in SOCKETIO_MESSAGE_QUEUE, so a job reaches its client whichever worker runs it; None (a single worker) when it is not set
+    url = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+
+    if not url:
+        return None
+
+    scheme = urlparse(url).scheme
+
+    if scheme not in CLIENT_MANAGERS:
+        raise ValueError(f"Unsupported Socket.IO message queue: {url}")
+
+    return CLIENT_MANAGERS[scheme](url)
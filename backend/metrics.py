@@ -0,0 +1,105 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds (seconds) of the duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Metrics are updated from the event loop and from worker threads
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+_HELP = {
+    "etl_stage_duration_seconds": "Duration of each ETL and report delivery stage",
+    "etl_job_duration_seconds": "Duration of each job from start to end",
+    "etl_stage_rows_total": "Rows processed by each stage",
+    "etl_stage_bytes_total": "Bytes read, written or transferred by each stage",
+    "etl_jobs_total": "Finished jobs by kind and status",
+    "etl_results_cache_total": "ETL runs served from a stored result (hit) or computed (miss)",
+}
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    # Add an observation to a histogram
+    key = (name, _labels(labels))
+
+    with _lock:
+        histogram = _histograms.setdefault(
+            key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        )
+
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][index] += 1
+
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+def increment(name, value=1, **labels):
+    # Add a value to a counter
+    key = (name, _labels(labels))
+
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def stage(name, timings=None):
+    # Time a stage of the ETL; the duration is also saved in "timings" (per run summary) when provided
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe("etl_stage_duration_seconds", seconds, stage=name)
+
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0) + seconds, 4)
+
+
+def render():
+    # Metrics in Prometheus text exposition format
+    lines = []
+
+    with _lock:
+        histograms = {key: dict(value) for key, value in _histograms.items()}
+        counters = dict(_counters)
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+
+            separator = "," if labels else ""
+
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append(
+                    f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}'
+                )
+
+            lines.append(
+                f'{name}_bucket{{{labels}{separator}le="+Inf"}} {histogram["count"]}'
+            )
+            lines.append(f"{name}_sum{{{labels}}} {histogram['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {histogram['count']}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{{{labels}}} {value}")
+
+    return "\n".join(lines) + "\n"
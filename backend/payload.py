@@ -0,0 +1,89 @@
+import gzip
+import io
+import json
+import os
+
+import polars as pl
+
+
+# Encodings of the results sent to the client, besides the default row-oriented JSON string
+FORMATS = ("json", "columnar", "arrow")
+COMPRESSIONS = ("gzip",)
+
+
+def _default_chunk_rows():
+    return int(os.getenv("ETL_PAYLOAD_CHUNK_ROWS", "10000"))
+
+
+def negotiate(offer=None):
+    # Pick the first format and compression offered by the client ({"formats", "compression", "chunk_rows"}) that the server supports
+    offer = offer or {}
+    formats = [name for name in offer.get("formats", []) if name in FORMATS]
+    compressions = [
+        name for name in offer.get("compression", []) if name in COMPRESSIONS
+    ]
+    chunk_rows = min(
+        int(offer.get("chunk_rows") or _default_chunk_rows()), _default_chunk_rows()
+    )
+
+    return {
+        "format": formats[0] if len(formats) > 0 else "json",
+        "compression": compressions[0] if len(compressions) > 0 else None,
+        "chunk_rows": max(chunk_rows, 1),
+    }
+
+
+def _columnar(df):
+    # Column-oriented JSON ({column: [values]}), with dates as ISO strings
+    return json.dumps(
+        df.with_columns(pl.col(pl.Date).cast(pl.String)).to_dict(as_series=False),
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+
+
+def _arrow(df):
+    buffer = io.BytesIO()
+    df.write_ipc_stream(buffer)
+
+    return buffer.getvalue()
+
+
+def encode(df, settings=None):
+    # Messages of an event carrying a DataFrame: a single row-oriented JSON string by default, or chunks of binary data in the negotiated format
+    settings = settings or negotiate()
+
+    if settings["format"] == "json":
+        return [df.write_json()]
+
+    serialize = _columnar if settings["format"] == "columnar" else _arrow
+    chunks = max(1, -(-df.height // settings["chunk_rows"]))
+    messages = []
+
+    for index in range(chunks):
+        data = serialize(
+            df.slice(index * settings["chunk_rows"], settings["chunk_rows"])
+        )
+
+        if settings["compression"] == "gzip":
+            data = gzip.compress(data, compresslevel=6)
+
+        messages.append(
+            {
+                "format": settings["format"],
+                "compression": settings["compression"],
+                "chunk": index,
+                "chunks": chunks,
+                "data": data,
+            }
+        )
+
+    return messages
+
+
+def size(messages):
+    # Bytes sent to the client
+    return sum(
+        len(message) if isinstance(message, str) else len(message["data"])
+        for message in messages
+    )
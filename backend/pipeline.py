@@ -0,0 +1,116 @@
+import asyncio
+import os
+
+# Modules
+from jobs import JobManager
+import artifacts
+import etl
+import portfolios
+import shared
+import simem
+
+
+# Dates being processed in this process (None is a run without a date) and their locks between workers, so the same date never runs twice at the same time
+_in_flight = {}
+
+
+def _max_parallel_dates():
+    return int(os.getenv("ETL_MAX_PARALLEL_DATES", "2"))
+
+
+class LogEmitter:
+    # Emitter of headless runs: prints the messages meant for the client and counts the errors
+    def __init__(self):
+        self.errors = 0
+
+    async def __call__(self, event, data=None, to=None):
+        if event != "events_messages":
+            return
+
+        for message in data if isinstance(data, list) else [data]:
+            if message["status"] == "error":
+                self.errors += 1
+
+            print(f"[{message['status']}] {message['content']}")
+
+
+def _claim(fecha):
+    # Reserve a date for this process; with several workers, also lock it in the shared directory (the lock is released if the worker exits)
+    if fecha in _in_flight:
+        return False
+
+    lock_file = None
+
+    if shared.directory() is not None:
+        lock_file = shared.try_lock(f"etl_{fecha}")
+
+        if lock_file is None:
+            return False
+
+    _in_flight[fecha] = lock_file
+
+    return True
+
+
+def _release(fecha):
+    lock_file = _in_flight.pop(fecha, None)
+
+    if lock_file is not None:
+        shared.unlock(lock_file)
+
+
+async def _run_date(job, fecha, options, send):
+    await etl.start_etl(
+        job, {**options, "fecha": str(fecha)} if fecha is not None else options
+    )
+
+    # Send the report only when the ETL produced one
+    if send and await job.run_blocking(artifacts.get, job.id) is not None:
+        await etl.send_report(job, {"job_id": job.id})
+
+
+async def run_dates(job_manager, sid, fechas, options=None, send=False):
+    # Run the ETL once per date (several dates at once, up to the concurrent jobs of the job manager), skipping repeated dates and dates already being processed. Returns the jobs started
+    jobs = []
+
+    for fecha in dict.fromkeys(fechas):
+        if not _claim(fecha):
+            print(f"Skipping ETL: date {fecha} is already being processed")
+            continue
+
+        try:
+            job = job_manager.submit(
+                "etl",
+                sid,
+                _run_date,
+                fecha,
+                options or {},
+                send,
+                profile=bool((options or {}).get("profile", False)),
+            )
+        except BaseException:
+            _release(fecha)
+            raise
+
+        # The date is released when the job ends in any way, also when it is cancelled (or the job manager shuts down) before it starts running
+        job.task.add_done_callback(lambda _, fecha=fecha: _release(fecha))
+        jobs.append(job)
+
+    await asyncio.gather(*(job.task for job in jobs))
+
+    return jobs
+
+
+async def run_headless(fechas, options=None, send=False):
+    # Run the ETL outside the server (command line); returns the jobs and the number of errors reported
+    emitter = LogEmitter()
+    job_manager = JobManager(emit=emitter, max_concurrent_jobs=_max_parallel_dates())
+
+    try:
+        jobs = await run_dates(job_manager, "cli", fechas, options, send)
+    finally:
+        job_manager.shutdown()
+        portfolios.shutdown()
+        await simem.close_client()
+
+    return jobs, emitter.errors
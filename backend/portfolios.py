@@ -0,0 +1,540 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import httpx
+import polars as pl
+
+# Modules
+from google_auth import drive_session
+import artifacts
+import delivery
+import drive_extract
+import excel
+import generators
+import history
+import metrics
+import payload
+import report
+import simem
+import transform
+import validation
+
+
+# Worker processes shared by the multi-portfolio runs, started on first use
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _settings():
+    return {
+        "processes": int(
+            os.getenv("ETL_PORTFOLIO_PROCESSES", str(min(4, os.cpu_count() or 1)))
+        ),
+    }
+
+
+class PortfolioError(Exception):
+    # Invalid multi-portfolio run; the message is shown to the client
+    pass
+
+
+def _get_pool():
+    # Processes are spawned (not forked), since forking a process that runs Polars and the event loop threads is not safe
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=_settings()["processes"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return _pool
+
+
+def shutdown():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def _run_in_process(function, *args):
+    # Run a CPU-bound stage of a portfolio in a worker process; arguments and results (DataFrames included) are pickled
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(_get_pool(), functools.partial(function, *args))
+
+
+def seleccionar(registry, nombres):
+    # Portfolios of a run: every configured portfolio ({"portafolios": true}) or the ones listed
+    if len(registry["portafolios"]) == 0:
+        raise PortfolioError(
+            "No hay portafolios configurados en el archivo de generadores"
+        )
+
+    if nombres is True:
+        return registry["portafolios"]
+
+    if isinstance(nombres, str):
+        nombres = [nombres]
+
+    if not isinstance(nombres, list):
+        raise PortfolioError(
+            'La opción "portafolios" debe ser true o una lista de portafolios'
+        )
+
+    for nombre in nombres:
+        if nombre not in registry["portafolios"]:
+            raise PortfolioError(f'Portafolio desconocido: "{nombre}"')
+
+    return {
+        nombre: registry["portafolios"][nombre] for nombre in dict.fromkeys(nombres)
+    }
+
+
+def _capacidad(archivos, portafolio, fecha, range_mode):
+    # Worker process: read the capacity workbooks of a portfolio that were not read before, then validate and transform its records. Returns the workbooks read (to be cached by the server), the validation errors and the capacity
+    leidos = []
+    dfs_capacidad_generacion = []
+
+    for archivo in archivos:
+        df_capacidad_generacion = archivo.get("records")
+
+        if df_capacidad_generacion is None:
+            df_capacidad_generacion = excel.read_capacity(archivo["content"])
+            leidos.append((archivo["checksum"], df_capacidad_generacion))
+
+        dfs_capacidad_generacion.append(df_capacidad_generacion)
+
+    df_capacidad_generacion = pl.concat(dfs_capacidad_generacion)
+
+    if fecha is not None:
+        df_capacidad_generacion = df_capacidad_generacion.filter(
+            pl.col("column_1").dt.date() == pl.lit(str(fecha)).str.to_date(strict=False)
+        )
+
+        # No capacity for the requested date
+        if df_capacidad_generacion.height == 0:
+            return {"leidos": leidos, "errores": [], "capacidad": None}
+
+    errores = validation.validar(
+        df_capacidad_generacion,
+        validation.reglas_capacidad(
+            generadores=portafolio["dtype"],
+            filas_esperadas=None if range_mode else portafolio["filas_esperadas"],
+            fecha_unica=not range_mode,
+        ),
+    )
+
+    if len(errores) > 0:
+        return {"leidos": leidos, "errores": errores, "capacidad": None}
+
+    return {
+        "leidos": leidos,
+        "errores": [],
+        "capacidad": transform.collect(
+            transform.capacidad_generacion(
+                df_capacidad_generacion.lazy(), portafolio["dtype"]
+            )
+        ),
+    }
+
+
+def _balance(df_capacidad_generacion, simem_records, portafolio):
+    # Worker process: daily and hourly balance of a portfolio, over the SIMEM records shared by every portfolio (the hourly join is collected once and both balances are built on it)
+    df_balance_horario = transform.collect(
+        transform.balance_horario(
+            df_capacidad_generacion.lazy(),
+            transform.despacho_programado(
+                simem_records[simem.DESPACHO_PROGRAMADO].lazy(), portafolio["dtype"]
+            ),
+        )
+    )
+
+    return transform.collect_all(
+        [
+            transform.balance_energia(
+                df_balance_horario.lazy(),
+                transform.precio_bolsa(simem_records[simem.PRECIO_BOLSA].lazy()),
+            ),
+            transform.balance_energia_horario(
+                df_balance_horario.lazy(),
+                (
+                    transform.precio_bolsa_horario(
+                        simem_records[simem.PRECIO_BOLSA_HORARIO].lazy()
+                    )
+                    if simem.PRECIO_BOLSA_HORARIO in simem_records
+                    else None
+                ),
+            ),
+        ]
+    )
+
+
+def desglose(df_balance_energia_consolidado):
+    # Balance and COP exposure of each portfolio, and the energy to sell and to buy
+    return (
+        df_balance_energia_consolidado.group_by("Portafolio")
+        .agg(
+            pl.col("Codigo").n_unique().alias("Generadores"),
+            pl.sum("Balance (kWh)"),
+            pl.sum("Compromisos (COP)"),
+            pl.col("Balance (kWh)")
+            .filter(pl.col("Operacion") == "Vender")
+            .sum()
+            .alias("Venta (kWh)"),
+            (-pl.col("Balance (kWh)"))
+            .filter(pl.col("Operacion") == "Comprar")
+            .sum()
+            .alias("Compra (kWh)"),
+        )
+        .sort("Portafolio")
+    )
+
+
+async def _error(job, content):
+    # Emit a message to the client indicating why the run stopped
+    await job.emit("events_messages", {"status": "error", "content": content})
+    await job.emit("stop_processing")
+
+
+async def _archivos(job, gdrive, portafolio, fecha, range_mode):
+    # Capacity workbooks of a portfolio: the records of the ones already read (from their Parquet copies) and the content of the others; None when its extraction folder has no XLSX file
+    with job.stage("extract_1_list"):
+        file_list = await job.run_blocking(
+            drive_extract.list_files, gdrive, portafolio["carpeta_extraccion"]
+        )
+
+    xlsx_files = [file for file in file_list if file["title"].endswith(".xlsx")]
+
+    if len(xlsx_files) == 0:
+        return None
+
+    if not range_mode and fecha is None:
+        xlsx_files = xlsx_files[:1]
+
+    archivos = []
+
+    for xlsx_file in xlsx_files:
+        with job.stage("extract_1_cache"):
+            df_capacidad_generacion = await job.run_blocking(
+                excel.load, xlsx_file.get("md5Checksum")
+            )
+
+        if df_capacidad_generacion is not None:
+            archivos.append({"records": df_capacidad_generacion})
+            continue
+
+        with job.stage("extract_1_download"):
+            xlsx_content = await job.run_blocking(
+                drive_extract.download, gdrive, xlsx_file["id"]
+            )
+            metrics.increment(
+                "etl_stage_bytes_total",
+                xlsx_content.getbuffer().nbytes,
+                stage="extract_1_download",
+            )
+
+        archivos.append(
+            {
+                "checksum": xlsx_file.get("md5Checksum"),
+                "content": xlsx_content.getvalue(),
+            }
+        )
+
+    return archivos
+
+
+async def _extract_transform_1(job, gdrive, nombre, portafolio, fecha, range_mode):
+    # Download the workbooks of a portfolio, then read, validate and transform them in a worker process
+    archivos = await _archivos(job, gdrive, portafolio, fecha, range_mode)
+
+    if archivos is None:
+        raise PortfolioError(
+            f'La carpeta de extracción del portafolio "{nombre}" no contiene un archivo XLSX'
+        )
+
+    with job.stage("transform_1"):
+        resultado = await _run_in_process(
+            _capacidad, archivos, portafolio, fecha, range_mode
+        )
+
+    # Save a Parquet copy of the workbooks read, for the next reads
+    for checksum, df_capacidad_generacion in resultado["leidos"]:
+        await job.run_blocking(excel.store, checksum, df_capacidad_generacion)
+
+    return resultado
+
+
+async def start_etl(job, options, payload_settings=None):
+    print(f"Starting multi-portfolio ETL: SID {job.sid}, job {job.id}")
+
+    fecha = options.get("fecha")
+    range_mode = bool(options.get("range", False))
+    dedup = bool(options.get("dedup", False))
+    hourly = bool(
+        options.get("hourly", os.getenv("ETL_HOURLY", "false").lower() == "true")
+    )
+
+    # Portfolios of the run and formats of the combined report
+    try:
+        for option in ("incremental", "escenarios"):
+            if options.get(option):
+                raise PortfolioError(
+                    f'La opción "{option}" no está disponible en el modo multiportafolio'
+                )
+
+        portafolios = seleccionar(generators.get_registry(), options["portafolios"])
+        formatos = report.formats(delivery.formats(), options.get("formatos"))
+    except (PortfolioError, report.ReportError) as error:
+        await _error(job, str(error))
+        return
+
+    # Class with methods to interact with the required drive (shared authorized session)
+    try:
+        with job.stage("drive_auth"):
+            gdrive = await job.run_blocking(drive_session.get)
+    except Exception:
+        await _error(job, "Error de autenticación en Google Drive")
+        return
+
+    await job.emit(
+        "events_messages",
+        {"status": "success", "content": "Autenticación exitosa en Google Drive"},
+    )
+
+    # EXTRACT 1 AND TRANSFORM 1
+    # Every portfolio is downloaded at once (the shared Drive session gives each worker thread its own HTTP connection), and each one is read, validated and transformed in a worker process as soon as its workbooks arrive
+    tareas = [
+        asyncio.ensure_future(
+            _extract_transform_1(job, gdrive, nombre, portafolio, fecha, range_mode)
+        )
+        for nombre, portafolio in portafolios.items()
+    ]
+
+    try:
+        resultados = dict(zip(portafolios, await asyncio.gather(*tareas)))
+    except PortfolioError as error:
+        await _error(job, str(error))
+        return
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+
+    errores = [
+        {**error, "content": f'Portafolio "{nombre}": {error["content"]}'}
+        for nombre, resultado in resultados.items()
+        for error in resultado["errores"]
+    ]
+
+    if len(errores) > 0:
+        # Emit a message to the client with every error found in the capacity files of every portfolio
+        await job.emit("events_messages", errores)
+        await job.emit("stop_processing")
+        return
+
+    for nombre, resultado in resultados.items():
+        if resultado["capacidad"] is None:
+            await _error(
+                job,
+                f'Los archivos de capacidad de generación del portafolio "{nombre}" no contienen registros de la fecha {fecha}',
+            )
+            return
+
+    dfs_capacidad = {
+        nombre: resultado["capacidad"] for nombre, resultado in resultados.items()
+    }
+    fechas = pl.concat(
+        [df_capacidad["Fecha"] for df_capacidad in dfs_capacidad.values()]
+    ).unique()
+
+    if dedup and await job.run_blocking(history.contains, fechas, list(portafolios)):
+        await job.emit(
+            "events_messages",
+            {
+                "status": "success",
+                "content": "El balance de energía de estas fechas ya fue calculado",
+            },
+        )
+        await job.emit("stop_processing")
+        return
+
+    await job.emit(
+        "events_messages",
+        {
+            "status": "success",
+            "content": f"Los archivos de capacidad de generación de {len(portafolios)} portafolio(s) fueron cargados y transformados exitosamente",
+        },
+    )
+
+    # EXTRACT 2 AND 3
+    # Every portfolio filters the same national datasets, so they are requested once for the dates and power generators of all the portfolios
+    datasets = [
+        (simem.DESPACHO_PROGRAMADO, "Despacho programado recursos de generación"),
+        (simem.PRECIO_BOLSA, "Precio de bolsa ponderado"),
+    ]
+
+    if hourly:
+        datasets.append((simem.PRECIO_BOLSA_HORARIO, "Precio de bolsa horario"))
+
+    with job.stage("extract_2_3"):
+        simem_records = await simem.fetch_datasets(
+            [dataset_id for dataset_id, _ in datasets],
+            fechas.min(),
+            fechas.max(),
+            plantas=sorted(
+                {
+                    codigo
+                    for portafolio in portafolios.values()
+                    for codigo in portafolio["codigos"]
+                }
+            ),
+        )
+
+    for dataset_id, dataset_name in datasets:
+        error = simem_records[dataset_id]
+
+        if isinstance(error, httpx.TimeoutException):
+            await _error(
+                job,
+                f'La solicitud del "{dataset_name}" a la API del SIMEM excedió el tiempo de espera',
+            )
+            return
+        elif isinstance(error, httpx.HTTPError):
+            await _error(
+                job,
+                f'Error de conexión a la API del SIMEM al solicitar el "{dataset_name}"',
+            )
+            return
+        elif isinstance(error, Exception):
+            raise error
+
+        metrics.increment(
+            "etl_stage_rows_total",
+            simem_records[dataset_id].height,
+            stage="extract_2_3",
+        )
+
+    await job.emit(
+        "events_messages",
+        {
+            "status": "success",
+            "content": "Los datos del SIMEM fueron cargados exitosamente",
+        },
+    )
+
+    # TRANSFORM 2 TO 4
+    # Balance of every portfolio at once in the worker processes; each one receives only the dispatch of its power generators
+    with job.stage("transform_2_4"):
+        balances = await asyncio.gather(
+            *(
+                _run_in_process(
+                    _balance,
+                    dfs_capacidad[nombre],
+                    {
+                        **simem_records,
+                        simem.DESPACHO_PROGRAMADO: simem_records[
+                            simem.DESPACHO_PROGRAMADO
+                        ].filter(pl.col("CodigoPlanta").is_in(portafolio["codigos"])),
+                    },
+                    portafolio,
+                )
+                for nombre, portafolio in portafolios.items()
+            )
+        )
+
+    # Combined report: the balance of every portfolio, identified by the "Portafolio" column
+    df_balance_energia_consolidado, df_balance_energia_horario = (
+        pl.concat(
+            [
+                df.select(pl.lit(nombre).alias("Portafolio"), pl.all())
+                for nombre, df in zip(portafolios, frames)
+            ]
+        )
+        for frames in zip(*balances)
+    )
+    df_desglose = desglose(df_balance_energia_consolidado)
+    metrics.increment(
+        "etl_stage_rows_total",
+        df_balance_energia_consolidado.height,
+        stage="transform_2_4",
+    )
+
+    await job.emit(
+        "events_messages",
+        {
+            "status": "success",
+            "content": "El balance de energía fue calculado exitosamente",
+        },
+    )
+    await job.emit("stop_processing")
+
+    # LOAD
+    # Emit the combined balance, its hourly breakdown in hourly mode and the totals of each portfolio, encoded as the client negotiated
+    eventos = [
+        ("energy_balance", df_balance_energia_consolidado),
+        ("energy_balance_portfolios", df_desglose),
+    ]
+
+    if hourly:
+        eventos.append(("energy_balance_hourly", df_balance_energia_horario))
+
+    for event, df in eventos:
+        with job.stage("load_json"):
+            messages = await job.run_blocking(payload.encode, df, payload_settings)
+
+        for message in messages:
+            await job.emit(event, message)
+
+    with job.stage("load_files"):
+        report_files = await report.write(job, df_balance_energia_consolidado, formatos)
+
+    metrics.increment(
+        "etl_stage_bytes_total",
+        sum(len(file["content"]) for file in report_files.values()),
+        stage="load_files",
+    )
+
+    # Each portfolio is saved apart in the history, so it only supersedes the previous runs of the same portfolio
+    with job.stage("load_history"):
+        for nombre in portafolios:
+            await job.run_blocking(
+                history.append,
+                job.id,
+                {
+                    "consolidado": df_balance_energia_consolidado.filter(
+                        pl.col("Portafolio") == nombre
+                    ),
+                    "horario": df_balance_energia_horario.filter(
+                        pl.col("Portafolio") == nombre
+                    ),
+                },
+                nombre,
+            )
+
+    # Keep the report files for the report delivery, named after the job that produced them
+    await job.run_blocking(
+        artifacts.save,
+        job,
+        {
+            file_format: {
+                "name": f"balance_energia_{date.today()}_{job.id}.{file_format}",
+                **file,
+            }
+            for file_format, file in report_files.items()
+        },
+    )
+
+    # Emit the duration of each stage to the client when requested
+    if options.get("timings", False):
+        await job.emit("etl_timings", job.timings)
+
+    print(f"Finished multi-portfolio ETL: SID {job.sid}, job {job.id}")
@@ -0,0 +1,222 @@
+import functools
+import os
+import shutil
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Modules
+import shared
+
+
+# Profile files of each job: {kind: (file name, media type)}
+FILES = {
+    "cpu": ("{job_id}.folded", "text/plain"),
+    "memoria": ("{job_id}_memoria.txt", "text/plain"),
+}
+
+# Guards the number of jobs being profiled: allocations are traced while there is at least one, in the whole process (the other jobs running at the same time pay for the tracing too)
+_lock = threading.Lock()
+_active = 0
+
+
+def _settings():
+    return {
+        "dir": os.getenv("ETL_PROFILE_DIR", "profiles"),
+        "interval": float(os.getenv("ETL_PROFILE_INTERVAL_SECONDS", "0.005")),
+        "top": int(os.getenv("ETL_PROFILE_TOP_ALLOCATIONS", "15")),
+        "frames": int(os.getenv("ETL_PROFILE_TRACEMALLOC_FRAMES", "1")),
+        "history": int(os.getenv("ETL_PROFILE_HISTORY", "20")),
+    }
+
+
+def _directory(settings):
+    # With several workers, the profiles are saved in the shared directory, so any worker serves them
+    return (
+        shared.path("profiles") if shared.directory() is not None else settings["dir"]
+    )
+
+
+def path(job_id, kind):
+    # Profile file of a job ("cpu" or "memoria"), or None when it does not exist
+    if not isinstance(job_id, str) or not job_id.isalnum() or kind not in FILES:
+        return None
+
+    file_path = os.path.join(
+        _directory(_settings()), job_id, FILES[kind][0].format(job_id=job_id)
+    )
+
+    return file_path if os.path.isfile(file_path) else None
+
+
+def _frame_name(frame):
+    # Functions are aggregated by module and qualified name (";" separates the frames of a folded stack)
+    code = frame.f_code
+    name = f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+
+    return name.replace(";", ":").replace(" ", "_")
+
+
+def _is_idle(frame):
+    # Event loop waiting for I/O (no coroutine running)
+    return frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith(
+        "selectors.py"
+    )
+
+
+def _megabytes(size):
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+class Profiler:
+    # Profile of a job: CPU samples of the threads running it (the event loop and the worker threads while they run its blocking stages) as folded stacks, and the Python allocations of each stage from tracemalloc snapshots at the stage boundaries
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.settings = _settings()
+        self.stacks = Counter()
+        self.samples = 0
+        self.stages = []
+        self._threads = {}
+        self._snapshot = None
+        self._stop = threading.Event()
+        self._sampler = None
+        # Snapshots are taken and compared in order in a thread of their own, off the event loop (and not sampled)
+        self._snapshots = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"profiler_snapshots_{job_id}"
+        )
+
+    def start(self):
+        global _active
+
+        with _lock:
+            if _active == 0:
+                tracemalloc.start(self.settings["frames"])
+
+            _active += 1
+
+        self._snapshots.submit(self._take_first_snapshot)
+        self._threads[threading.get_ident()] = "event_loop"
+        self._sampler = threading.Thread(
+            target=self._sample, name=f"profiler_{self.job_id}", daemon=True
+        )
+        self._sampler.start()
+
+    def _sample(self):
+        # Sample the stack of every thread running the job at a fixed interval
+        while not self._stop.wait(self.settings["interval"]):
+            frames = sys._current_frames()
+
+            for ident, role in list(self._threads.items()):
+                frame = frames.get(ident)
+
+                if frame is None or _is_idle(frame):
+                    continue
+
+                stack = []
+
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+
+                self.stacks[";".join([role, *reversed(stack)])] += 1
+
+            self.samples += 1
+
+    def traced(self, function):
+        # Sample the worker thread while it runs a blocking stage of the job
+        @functools.wraps(function)
+        def run(*args, **kwargs):
+            ident = threading.get_ident()
+            self._threads[ident] = "worker"
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._threads.pop(ident, None)
+
+        return run
+
+    def _take_first_snapshot(self):
+        self._snapshot = tracemalloc.take_snapshot()
+
+    def _compare(self, name, current, peak):
+        # Allocations of a stage (those of the stages that ended meanwhile are attributed to the next one)
+        snapshot = tracemalloc.take_snapshot()
+
+        self.stages.append(
+            (
+                name,
+                current,
+                peak,
+                snapshot.compare_to(self._snapshot, "lineno")[: self.settings["top"]],
+            )
+        )
+        self._snapshot = snapshot
+
+    @contextmanager
+    def stage(self, name, timer):
+        # Allocations of the stage are measured after its timer, so measuring them is not part of its duration; the event loop only reads the traced memory, the snapshot is taken in the snapshot thread so the clients do not wait for it
+        try:
+            with timer:
+                yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            self._snapshots.submit(self._compare, name, current, peak)
+
+    def stop(self):
+        # Stop sampling and tracing, and save the profile files of the job
+        global _active
+
+        self._stop.set()
+        self._sampler.join()
+        self._snapshots.shutdown(wait=True)
+
+        with _lock:
+            _active -= 1
+
+            if _active == 0:
+                tracemalloc.stop()
+
+        self._save()
+
+    def _save(self):
+        directory = _directory(self.settings)
+        job_directory = os.path.join(directory, self.job_id)
+        os.makedirs(job_directory, exist_ok=True)
+
+        # Folded stacks ("frame;frame;... count"), readable by flamegraph.pl, inferno or speedscope
+        cpu_lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+
+        memory_lines = []
+
+        for name, current, peak, statistics in self.stages:
+            memory_lines.append(
+                f"Stage {name}: traced {_megabytes(current)} (peak {_megabytes(peak)})"
+            )
+            memory_lines.extend(f"    {statistic}" for statistic in statistics)
+            memory_lines.append("")
+
+        for kind, lines in (("cpu", cpu_lines), ("memoria", memory_lines)):
+            file_path = os.path.join(
+                job_directory, FILES[kind][0].format(job_id=self.job_id)
+            )
+            temporary_path = f"{file_path}.tmp"
+
+            with open(temporary_path, "w", encoding="utf-8") as profile_file:
+                profile_file.write("\n".join(lines) + "\n")
+
+            os.replace(temporary_path, file_path)
+
+        # Keep the profiles of the last ETL_PROFILE_HISTORY jobs
+        job_directories = sorted(
+            (entry for entry in os.scandir(directory) if entry.is_dir()),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+
+        for entry in job_directories[self.settings["history"] :]:
+            shutil.rmtree(entry.path, ignore_errors=True)
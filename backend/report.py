@@ -0,0 +1,192 @@
+import asyncio
+import gzip
+import io
+import os
+
+import polars as pl
+import pyarrow as pa
+import xlsxwriter
+
+
+# Excel sheets hold at most 1048576 rows, the header included
+XLSX_MAX_ROWS = 1_048_576
+
+# Excel stores dates as days since 1899-12-30 (25569 days before 1970-01-01)
+XLSX_EPOCH_DAYS = 25569
+
+# Number formats of the streamed XLSX sheets (the ones Polars uses for its tables)
+XLSX_FORMATS = {
+    "date": {"num_format": "yyyy-mm-dd"},
+    "integer": {"num_format": "#,##0;[Red]-#,##0"},
+    "float": {"num_format": "#,##0.000;[Red]-#,##0.000"},
+}
+
+
+def _settings():
+    return {
+        "formats": [
+            name.strip()
+            for name in os.getenv("ETL_REPORT_FORMATS", "").split(",")
+            if name.strip()
+        ],
+        "xlsx_streaming_rows": int(
+            os.getenv("ETL_REPORT_XLSX_STREAMING_ROWS", "50000")
+        ),
+        "gzip_level": int(os.getenv("ETL_REPORT_GZIP_LEVEL", "6")),
+        "zstd_level": int(os.getenv("ETL_REPORT_ZSTD_LEVEL", "3")),
+        "parquet_compression": os.getenv("ETL_REPORT_PARQUET_COMPRESSION", "zstd"),
+    }
+
+
+class ReportError(Exception):
+    # Invalid report format; the message is shown to the client
+    pass
+
+
+def _csv(df, settings):
+    buffer = io.BytesIO()
+    df.write_csv(buffer)
+
+    return buffer.getvalue()
+
+
+def _csv_gzip(df, settings):
+    # Without a modification time, so the same report always has the same content
+    return gzip.compress(
+        _csv(df, settings), compresslevel=settings["gzip_level"], mtime=0
+    )
+
+
+def _csv_zstd(df, settings):
+    # Zstandard frame from the codec bundled with pyarrow
+    return pa.Codec("zstd", compression_level=settings["zstd_level"]).compress(
+        _csv(df, settings), asbytes=True
+    )
+
+
+def _parquet(df, settings):
+    buffer = io.BytesIO()
+    df.write_parquet(buffer, compression=settings["parquet_compression"])
+
+    return buffer.getvalue()
+
+
+def _xlsx_streaming(df, buffer):
+    # XlsxWriter constant memory mode: each row is flushed to a temporary file as soon as the next one starts, so memory does not grow with the report (rows beyond the limit of a sheet continue in a new sheet)
+    workbook = xlsxwriter.Workbook(
+        buffer, {"constant_memory": True, "nan_inf_to_errors": True}
+    )
+    header_format = workbook.add_format({"bold": True})
+    cell_formats = {
+        kind: workbook.add_format(properties)
+        for kind, properties in XLSX_FORMATS.items()
+    }
+
+    # Every column is written with a single XlsxWriter method (dates as Excel serial numbers)
+    expressions = []
+    columns = []
+
+    for name, dtype in df.schema.items():
+        if dtype == pl.Date:
+            expressions.append(pl.col(name).cast(pl.Int32) + XLSX_EPOCH_DAYS)
+            columns.append(("number", cell_formats["date"]))
+        elif dtype.is_integer():
+            expressions.append(pl.col(name))
+            columns.append(("number", cell_formats["integer"]))
+        elif dtype.is_float():
+            expressions.append(pl.col(name))
+            columns.append(("number", cell_formats["float"]))
+        elif dtype == pl.Boolean:
+            expressions.append(pl.col(name))
+            columns.append(("boolean", None))
+        else:
+            expressions.append(pl.col(name).cast(pl.String))
+            columns.append(("string", None))
+
+    df_cells = df.select(expressions)
+    rows_per_sheet = XLSX_MAX_ROWS - 1
+
+    for offset in range(0, max(df.height, 1), rows_per_sheet):
+        worksheet = workbook.add_worksheet()
+        worksheet.freeze_panes(1, 0)
+
+        for column_index, name in enumerate(df.columns):
+            worksheet.set_column(column_index, column_index, max(len(name), 10) + 2)
+
+        worksheet.write_row(0, 0, df.columns, header_format)
+
+        writers = [
+            (getattr(worksheet, f"write_{kind}"), cell_format)
+            for kind, cell_format in columns
+        ]
+
+        for row_index, row in enumerate(
+            df_cells.slice(offset, rows_per_sheet).iter_rows(), 1
+        ):
+            for column_index, (value, (write, cell_format)) in enumerate(
+                zip(row, writers)
+            ):
+                if value is not None:
+                    write(row_index, column_index, value, cell_format)
+
+    workbook.close()
+
+
+def _xlsx(df, settings):
+    # Polars table for small reports; big reports are streamed row by row
+    buffer = io.BytesIO()
+
+    if df.height <= settings["xlsx_streaming_rows"]:
+        df.write_excel(buffer)
+    else:
+        _xlsx_streaming(df, buffer)
+
+    return buffer.getvalue()
+
+
+# Report formats ({format: (media type, writer)}); the format is also the extension of the file
+FORMATS = {
+    "csv": ("text/csv", _csv),
+    "csv.gz": ("application/gzip", _csv_gzip),
+    "csv.zst": ("application/zstd", _csv_zstd),
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        _xlsx,
+    ),
+    "parquet": ("application/vnd.apache.parquet", _parquet),
+}
+
+
+def formats(destination_formats, requested=None):
+    # Formats to write: the ones received by the delivery destinations, the ones in ETL_REPORT_FORMATS and the ones requested by the client
+    if isinstance(requested, str):
+        requested = [requested]
+
+    if requested is not None and not isinstance(requested, list):
+        raise ReportError("Los formatos del informe deben ser una lista")
+
+    names = [*destination_formats, *_settings()["formats"], *(requested or [])]
+
+    for name in names:
+        if not isinstance(name, str) or name not in FORMATS:
+            raise ReportError(
+                f'Formato de informe desconocido: "{name}" (formatos disponibles: {", ".join(FORMATS)})'
+            )
+
+    return list(dict.fromkeys(names))
+
+
+async def write(job, df, file_formats):
+    # Serialize the report frame in every format at once, each one in a worker thread (Polars and the compressors release the GIL while they run). Every writer gets its own copy of the frame (the columns are shared), since Polars does not allow writing one frame from several threads
+    settings = _settings()
+    contents = await asyncio.gather(
+        *(
+            job.run_blocking(FORMATS[file_format][1], df.clone(), settings)
+            for file_format in file_formats
+        )
+    )
+
+    return {
+        file_format: {"content": content, "media_type": FORMATS[file_format][0]}
+        for file_format, content in zip(file_formats, contents)
+    }
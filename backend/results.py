@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import polars as pl
+
+# Modules
+import payload
+import shared
+
+
+# Increase when the way results are computed changes, so stored results are computed again
+CACHE_VERSION = 1
+
+# Guards the in-memory tier and the disk tier against concurrent jobs
+_lock = threading.Lock()
+
+# Results of the last runs by fingerprint ({fingerprint: {"frames": {name: DataFrame}, "files": {format: {"content", "media_type"}}, "messages": {}}}), least recently used first
+_memory = OrderedDict()
+
+# Computations in progress by fingerprint (event loop only); identical requests wait for them instead of computing the same result
+_in_flight = {}
+
+
+def _settings():
+    return {
+        "enabled": os.getenv("RESULTS_CACHE_ENABLED", "true").lower() == "true",
+        "directory": os.getenv("RESULTS_CACHE_DIR", "results_cache"),
+        "memory_entries": int(os.getenv("RESULTS_CACHE_MEMORY_ENTRIES", "16")),
+        "max_entries": int(os.getenv("RESULTS_CACHE_MAX_ENTRIES", "100")),
+    }
+
+
+def dataset_version(df):
+    # Versions and number of records of a SIMEM dataset (a new settlement of SIMEM data is published as a new "Version")
+    versions = (
+        sorted(df["Version"].cast(pl.String).unique().drop_nulls().to_list())
+        if "Version" in df.columns
+        else []
+    )
+
+    return {"versions": versions, "records": df.height}
+
+
+def fingerprint(inputs):
+    # Key of a result: hash of every input that determines it (JSON serializable); None when an input is unknown, so the result is not cached
+    if not _settings()["enabled"] or inputs is None:
+        return None
+
+    return hashlib.sha256(
+        json.dumps(
+            {"version": CACHE_VERSION, **inputs}, sort_keys=True, default=str
+        ).encode()
+    ).hexdigest()
+
+
+def _remember(key, entry, settings):
+    _memory[key] = entry
+    _memory.move_to_end(key)
+
+    while len(_memory) > settings["memory_entries"]:
+        _memory.popitem(last=False)
+
+
+def _entry_directory(settings, key):
+    return os.path.join(settings["directory"], key)
+
+
+def load(key):
+    # Stored result of a fingerprint, from memory or else from disk (None when it was never computed)
+    settings = _settings()
+
+    if key is None:
+        return None
+
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return _memory[key]
+
+        directory = _entry_directory(settings, key)
+
+        try:
+            with open(os.path.join(directory, "entry.json"), "r") as entry_file:
+                metadata = json.load(entry_file)
+
+            entry = {
+                "frames": {
+                    name: pl.read_parquet(os.path.join(directory, f"{name}.parquet"))
+                    for name in metadata["frames"]
+                },
+                "files": {},
+                "messages": {},
+            }
+
+            for file_format, media_type in metadata["files"].items():
+                with open(os.path.join(directory, f"report.{file_format}"), "rb") as f:
+                    entry["files"][file_format] = {
+                        "content": f.read(),
+                        "media_type": media_type,
+                    }
+
+            # The modification time tracks the last use of each result on disk
+            os.utime(directory)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Never stored, or removed by another worker while it was read
+            return None
+
+        _remember(key, entry, settings)
+
+        return entry
+
+
+def store(key, entry):
+    # Save a result in memory and on disk, removing the least recently used results beyond the limit
+    settings = _settings()
+
+    if key is None:
+        return
+
+    with _lock:
+        _remember(key, entry, settings)
+
+        directory = _entry_directory(settings, key)
+
+        if os.path.isdir(directory):
+            return
+
+        # Write into a temporary directory renamed at the end, so a crash never leaves a result half written (unique to this worker, since another one may be storing the same result)
+        temporary_directory = shared.temporary_name(directory)
+        os.makedirs(temporary_directory)
+
+        for name, df in entry["frames"].items():
+            df.write_parquet(os.path.join(temporary_directory, f"{name}.parquet"))
+
+        for file_format, file in entry["files"].items():
+            with open(
+                os.path.join(temporary_directory, f"report.{file_format}"), "wb"
+            ) as f:
+                f.write(file["content"])
+
+        with open(os.path.join(temporary_directory, "entry.json"), "w") as entry_file:
+            json.dump(
+                {
+                    "frames": list(entry["frames"]),
+                    "files": {
+                        file_format: file["media_type"]
+                        for file_format, file in entry["files"].items()
+                    },
+                },
+                entry_file,
+            )
+
+        with shared.worker_lock("results_cache"):
+            # Another worker stored the same result meanwhile
+            if os.path.isdir(directory):
+                shutil.rmtree(temporary_directory, ignore_errors=True)
+                return
+
+            os.replace(temporary_directory, directory)
+
+            entries = sorted(
+                (
+                    os.path.join(settings["directory"], name)
+                    for name in os.listdir(settings["directory"])
+                    if not name.endswith(".tmp")
+                ),
+                key=os.path.getmtime,
+            )
+
+            for old_directory in entries[
+                : max(0, len(entries) - settings["max_entries"])
+            ]:
+                shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def messages(entry, name, payload_settings):
+    # Messages of a result frame encoded as a client negotiated, encoded once per encoding
+    key = (name, json.dumps(payload_settings, sort_keys=True))
+
+    if key not in entry["messages"]:
+        entry["messages"][key] = payload.encode(entry["frames"][name], payload_settings)
+
+    return entry["messages"][key]
+
+
+async def acquire(key, load_entry):
+    # Stored result of a fingerprint ("load_entry" is an async function reading it), waiting for an identical computation in progress if there is one. None means that the caller computes the result and must call "release" when it ends
+    if key is None:
+        return None
+
+    while key in _in_flight:
+        entry = await asyncio.shield(_in_flight[key])
+
+        # The computation failed: the caller tries again
+        if entry is not None:
+            return entry
+
+    _in_flight[key] = asyncio.get_running_loop().create_future()
+
+    # A failed or cancelled load releases the fingerprint, so the identical requests do not wait forever
+    try:
+        entry = await load_entry(key)
+    except BaseException:
+        release(key)
+        raise
+
+    if entry is not None:
+        release(key, entry)
+
+    return entry
+
+
+def release(key, entry=None):
+    # End the computation of a fingerprint, handing its result (None when it failed) to the requests waiting for it
+    future = _in_flight.pop(key, None)
+
+    if future is not None and not future.done():
+        future.set_result(entry)
@@ -0,0 +1,176 @@
+import os
+
+import numpy as np
+import polars as pl
+
+
+def _settings():
+    return {
+        "max_scenarios": int(os.getenv("ETL_SCENARIOS_MAX", "1000")),
+        "percentiles": [
+            float(value)
+            for value in os.getenv("ETL_SCENARIO_PERCENTILES", "5,50,95").split(",")
+            if value.strip()
+        ],
+    }
+
+
+class ScenarioError(Exception):
+    # Invalid scenario matrix; the message is shown to the client
+    pass
+
+
+def _factor(value, description):
+    try:
+        factor = float(value)
+    except (TypeError, ValueError):
+        raise ScenarioError(f"{description} no es un número: {value!r}")
+
+    if not np.isfinite(factor) or factor < 0:
+        raise ScenarioError(f"{description} debe ser un número positivo: {value!r}")
+
+    return factor
+
+
+def _index(codigos, codigo):
+    try:
+        return codigos.index(codigo)
+    except ValueError:
+        raise ScenarioError(
+            f'Los escenarios contienen un generador que no es de interés: "{codigo}"'
+        )
+
+
+def _range(value, description):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ScenarioError(f"{description} debe ser un rango [mínimo, máximo]")
+
+    low, high = (_factor(limit, description) for limit in value)
+
+    if low > high:
+        raise ScenarioError(f"{description} debe ser un rango [mínimo, máximo]")
+
+    return low, high
+
+
+def matriz(spec, codigos):
+    # Scenario matrix: names, available fraction of the capacity of each power generator ("disponibilidad", scenarios x generators) and price multiplier ("precio", one per scenario). "spec" is either a list of scenarios, e.g. [{"nombre": "Sequía", "disponibilidad": {"QUI1": 0.8}, "precio": 1.3}], or a sampling of "n" scenarios with uniform ranges, e.g. {"n": 500, "disponibilidad": {"QUI1": [0.7, 1]}, "precio": [0.8, 1.5], "semilla": 1}; generators and prices left out keep their base value
+    settings = _settings()
+
+    if isinstance(spec, dict):
+        n = spec.get("n")
+
+        if not isinstance(n, int) or isinstance(n, bool) or n < 1:
+            raise ScenarioError(
+                'El número de escenarios ("n") debe ser un entero positivo'
+            )
+    elif isinstance(spec, list) and len(spec) > 0:
+        n = len(spec)
+    else:
+        raise ScenarioError("Los escenarios deben ser una lista o un muestreo")
+
+    if n > settings["max_scenarios"]:
+        raise ScenarioError(
+            f"El número de escenarios ({n}) supera el máximo permitido ({settings['max_scenarios']})"
+        )
+
+    disponibilidad = np.ones((n, len(codigos)))
+    precio = np.ones(n)
+
+    if isinstance(spec, dict):
+        # Every range is sampled independently with the same seeded generator, so a seed always gives the same scenarios
+        rng = np.random.default_rng(spec.get("semilla"))
+
+        for codigo, rango in (spec.get("disponibilidad") or {}).items():
+            disponibilidad[:, _index(codigos, codigo)] = rng.uniform(
+                *_range(rango, f'La disponibilidad de "{codigo}"'), n
+            )
+
+        if "precio" in spec:
+            precio = rng.uniform(*_range(spec["precio"], "El precio"), n)
+
+        nombres = [f"Escenario {i + 1}" for i in range(n)]
+    else:
+        nombres = []
+
+        for i, escenario in enumerate(spec):
+            if not isinstance(escenario, dict):
+                raise ScenarioError(f"El escenario {i + 1} no es válido")
+
+            nombre = str(escenario.get("nombre", f"Escenario {i + 1}"))
+
+            for codigo, factor in (escenario.get("disponibilidad") or {}).items():
+                disponibilidad[i, _index(codigos, codigo)] = _factor(
+                    factor, f'La disponibilidad de "{codigo}" en "{nombre}"'
+                )
+
+            precio[i] = _factor(escenario.get("precio", 1), f'El precio en "{nombre}"')
+            nombres.append(nombre)
+
+    return {
+        "codigos": codigos,
+        "nombres": nombres,
+        "disponibilidad": disponibilidad,
+        "precio": precio,
+    }
+
+
+def evaluar(df_totales, matriz_escenarios):
+    # Balance and COP exposure of every power generator in every scenario. Both are linear in the capacity and the price, so each scenario only scales the totals of each generator over the run (one broadcast over scenarios x generators instead of one pipeline run per scenario):
+    #   balance = disponibilidad * capacidad - compromiso
+    #   exposición = precio * (disponibilidad * capacidad valorada - compromiso valorado)
+    settings = _settings()
+    codigos = matriz_escenarios["codigos"]
+
+    # Totals aligned with the generators of the matrix (generators without records count as zero)
+    df_totales = (
+        pl.DataFrame({"Codigo": codigos})
+        .join(df_totales, on="Codigo", how="left")
+        .fill_null(0)
+    )
+    capacidad, compromiso, capacidad_cop, compromiso_cop = (
+        df_totales[column].cast(pl.Float64).to_numpy()
+        for column in [
+            "Capacidad Total (kWh)",
+            "Compromiso Total (kWh)",
+            "Capacidad Total (COP)",
+            "Compromiso Total (COP)",
+        ]
+    )
+
+    disponibilidad = matriz_escenarios["disponibilidad"]
+    precio = matriz_escenarios["precio"][:, np.newaxis]
+    balance = disponibilidad * capacidad - compromiso
+    exposicion = precio * (disponibilidad * capacidad_cop - compromiso_cop)
+
+    # Distribution of each generator across the scenarios; the worst case is the scenario with the lowest exposure (largest purchase)
+    percentiles = settings["percentiles"]
+    balance_percentiles = np.percentile(balance, percentiles, axis=0)
+    exposicion_percentiles = np.percentile(exposicion, percentiles, axis=0)
+    peor_caso = exposicion.argmin(axis=0)
+    generadores = np.arange(len(codigos))
+
+    return pl.DataFrame(
+        {
+            "Codigo": codigos,
+            "Escenarios": [len(matriz_escenarios["nombres"])] * len(codigos),
+            "Balance Base (kWh)": capacidad - compromiso,
+            "Compromisos Base (COP)": capacidad_cop - compromiso_cop,
+            **{
+                f"Balance P{percentil:g} (kWh)": values
+                for percentil, values in zip(percentiles, balance_percentiles)
+            },
+            **{
+                f"Compromisos P{percentil:g} (COP)": values
+                for percentil, values in zip(percentiles, exposicion_percentiles)
+            },
+            "Balance Peor Caso (kWh)": balance[peor_caso, generadores],
+            "Compromisos Peor Caso (COP)": exposicion[peor_caso, generadores],
+            "Escenario Peor Caso": [
+                matriz_escenarios["nombres"][index] for index in peor_caso
+            ],
+        }
+    ).with_columns(
+        pl.col("^Balance .*$").round().cast(pl.Int64),
+        pl.col("^Compromisos .*$").round().cast(pl.Int64),
+    )
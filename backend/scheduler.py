@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta
+
+
+# Allowed values of each field of a cron expression: minute, hour, day of month, month and day of week (0 or 7 is Sunday)
+FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(field, low, high):
+    values = set()
+
+    for part in field.split(","):
+        expression, _, step = part.partition("/")
+        step = int(step) if step else 1
+
+        if expression == "*":
+            start, end = low, high
+        elif "-" in expression:
+            start, end = (int(value) for value in expression.split("-"))
+        else:
+            start = int(expression)
+            end = high if step > 1 else start
+
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Invalid cron field: {field}")
+
+        values.update(range(start, end + 1, step))
+
+    return values
+
+
+def parse(expression):
+    # Cron expression with five fields ("minute hour day-of-month month day-of-week"), e.g. "0 6 * * 1-5"
+    fields = expression.split()
+
+    if len(fields) != 5:
+        raise ValueError(f"Invalid cron expression: {expression}")
+
+    minutes, hours, days, months, weekdays = (
+        _parse_field(field, low, high) for field, (low, high) in zip(fields, FIELDS)
+    )
+
+    if 7 in weekdays:
+        weekdays.add(0)
+
+    return {
+        "minutes": minutes,
+        "hours": hours,
+        "days": days,
+        "months": months,
+        "weekdays": weekdays,
+        # As in cron, when both day fields are restricted a day matches either of them
+        "any_day": fields[2] != "*" and fields[4] != "*",
+        "every_day": fields[2] == "*" and fields[4] == "*",
+    }
+
+
+def _day_matches(schedule, moment):
+    if schedule["every_day"]:
+        return True
+
+    # Python weekdays start on Monday, cron weekdays on Sunday
+    day = moment.day in schedule["days"]
+    weekday = (moment.weekday() + 1) % 7 in schedule["weekdays"]
+
+    if schedule["any_day"]:
+        return day or weekday
+
+    return day and weekday
+
+
+def next_run(schedule, after):
+    # First minute after "after" that matches the schedule
+    moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = moment + timedelta(days=366 * 5)
+
+    while moment < limit:
+        if moment.month not in schedule["months"]:
+            moment = (moment.replace(day=1) + timedelta(days=32)).replace(
+                day=1, hour=0, minute=0
+            )
+        elif not _day_matches(schedule, moment):
+            moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+        elif moment.hour not in schedule["hours"]:
+            moment = moment.replace(minute=0) + timedelta(hours=1)
+        elif moment.minute not in schedule["minutes"]:
+            moment += timedelta(minutes=1)
+        else:
+            return moment
+
+    raise ValueError("The cron expression never matches")
+
+
+async def run(expression, callback):
+    # Background task that awaits "callback" at every time matching the cron expression (local time); a run that lasts past the next time skips it
+    schedule = parse(expression)
+
+    while True:
+        now = datetime.now()
+        moment = next_run(schedule, now)
+        await asyncio.sleep((moment - now).total_seconds())
+
+        try:
+            await callback()
+        except Exception as error:
+            print(f"Scheduled run failed: {error}")
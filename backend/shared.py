@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+# File locks are only available on POSIX systems; the shared state between workers requires them
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def directory():
+    # Directory with the state shared by the server workers (report outputs, job states and locks), from ETL_SHARED_DIR; None when every worker keeps its own state in memory
+    shared_directory = os.getenv("ETL_SHARED_DIR")
+
+    if shared_directory and fcntl is None:
+        raise RuntimeError("ETL_SHARED_DIR requires file locks (POSIX systems)")
+
+    return shared_directory or None
+
+
+def path(*parts):
+    return os.path.join(directory(), *parts)
+
+
+def _lock_file(name):
+    os.makedirs(path("locks"), exist_ok=True)
+
+    return open(path("locks", f"{name}.lock"), "a")
+
+
+@contextmanager
+def lock(name):
+    # Exclusive lock between the workers, waiting until it is free
+    with _lock_file(name) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def worker_lock(name):
+    # Exclusive lock between the workers for the state they share in the working directory (caches and manifest); nothing to lock with a single worker
+    if directory() is None:
+        yield
+        return
+
+    with lock(name):
+        yield
+
+
+def try_lock(name):
+    # Exclusive lock between the workers without waiting: the lock file (released with "unlock", or when the worker exits), or None when another worker holds it
+    lock_file = _lock_file(name)
+
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+
+    return lock_file
+
+
+def unlock(lock_file):
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+
+def read_json(file_path):
+    try:
+        with open(file_path, "r") as json_file:
+            return json.load(json_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def temporary_name(file_path):
+    # Name of the file written before replacing "file_path", unique to the worker and thread writing it
+    return f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def write_json(file_path, data):
+    # Replace the file atomically so other workers never read it half written
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = temporary_name(file_path)
+
+    with open(temporary_path, "w") as json_file:
+        json.dump(data, json_file)
+
+    os.replace(temporary_path, file_path)
+
+
+def claim(name, key):
+    # True for the first worker that claims "key" under "name" (e.g. a scheduled run time), so work triggered in every worker runs once; always True with a single worker
+    if directory() is None:
+        return True
+
+    with lock(name):
+        claims = read_json(path(f"{name}.json")) or {}
+
+        if claims.get("key") == key:
+            return False
+
+        write_json(path(f"{name}.json"), {"key": key})
+
+    return True
@@ -0,0 +1,299 @@
+import asyncio
+import codecs
+import json
+import os
+import random
+import re
+from datetime import timedelta
+
+import httpx
+import polars as pl
+
+# Modules
+import simem_cache
+
+
+# SIMEM datasets used by the ETL
+DESPACHO_PROGRAMADO = "ff027b"
+PRECIO_BOLSA = "96D56E"
+PRECIO_BOLSA_HORARIO = "EC6945"
+
+# Fields of the SIMEM records used by the ETL and their types; other fields are not decoded ("Fecha" is the date of daily datasets)
+COLUMNS = {
+    "Fecha": pl.String,
+    "FechaHora": pl.String,
+    "Valor": pl.Float64,
+    "CodigoPlanta": pl.String,
+    "CodigoVariable": pl.String,
+    "Version": pl.String,
+}
+
+# Start of the "records" array in the body of a SIMEM response, and separators between records
+RECORDS_START = re.compile(r'"records"\s*:\s*\[')
+RECORDS_SEPARATOR = re.compile(r"[\s,]*")
+
+# Shared asynchronous client and per-host semaphores (created lazily inside the running event loop)
+_client = None
+_host_semaphores = {}
+
+
+def _settings():
+    # Read the SIMEM client settings from environment variables when the client is created, so values in the .env file are honored
+    return {
+        "base_url": os.getenv(
+            "SIMEM_BASE_URL", "https://www.simem.co/backend-files/api/PublicData"
+        ),
+        "max_connections": int(os.getenv("SIMEM_MAX_CONNECTIONS", "10")),
+        "max_per_host": int(os.getenv("SIMEM_MAX_CONCURRENCY_PER_HOST", "4")),
+        "max_retries": int(os.getenv("SIMEM_MAX_RETRIES", "3")),
+        "backoff_factor": float(os.getenv("SIMEM_BACKOFF_FACTOR", "0.5")),
+        "max_window_days": int(os.getenv("SIMEM_MAX_WINDOW_DAYS", "31")),
+    }
+
+
+def get_client():
+    # Keep-alive connection pool shared by every request to SIMEM API
+    global _client
+
+    if _client is None or _client.is_closed:
+        settings = _settings()
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(4, connect=7),
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_connections"],
+                keepalive_expiry=30,
+            ),
+        )
+
+    return _client
+
+
+async def close_client():
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+    _host_semaphores.clear()
+
+
+def _host_semaphore(host):
+    # Limit the number of simultaneous requests sent to the same host
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(_settings()["max_per_host"])
+
+    return _host_semaphores[host]
+
+
+def date_windows(start_date, end_date, window_days):
+    # Split the date range in consecutive windows of at most "window_days" days (both ends included)
+    windows = []
+    window_start = start_date
+
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(days=1)
+
+    return windows
+
+
+def _number(value):
+    # SIMEM sends "Valor" either as a number or as text
+    return float(value) if value is not None else None
+
+
+class RecordsDecoder:
+    # Incremental decoder of the "records" array of a SIMEM response: each record is decoded as soon as its bytes arrive and only the fields in COLUMNS of the records kept (those of the power generators of interest, when "plantas" is given) are appended to typed columns, so neither the whole body nor every record is held in memory
+    def __init__(self, plantas=None):
+        self.plantas = set(plantas) if plantas is not None else None
+        self.columns = {name: [] for name in COLUMNS}
+        self.finished = False
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._in_records = False
+
+    def feed(self, chunk):
+        # Keep only the text not decoded yet and the new chunk
+        self._buffer = self._buffer[self._position :] + self._text.decode(chunk)
+        self._position = 0
+
+        if not self._in_records and not self.finished:
+            match = RECORDS_START.search(self._buffer)
+
+            if match is None:
+                # The start of the array may be split between two chunks
+                self._position = max(0, len(self._buffer) - 64)
+                return
+
+            self._position = match.end()
+            self._in_records = True
+
+        while self._in_records:
+            position = RECORDS_SEPARATOR.match(self._buffer, self._position).end()
+            self._position = position
+
+            if position == len(self._buffer):
+                return
+
+            if self._buffer[position] == "]":
+                self._in_records = False
+                self.finished = True
+                return
+
+            try:
+                record, self._position = self._json.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                # Incomplete record: wait for the next chunk
+                return
+
+            self._append(record)
+
+    def _append(self, record):
+        # Records of other power generators are dropped (records without "CodigoPlanta", e.g. prices, are kept)
+        if (
+            self.plantas is not None
+            and "CodigoPlanta" in record
+            and record["CodigoPlanta"] not in self.plantas
+        ):
+            return
+
+        for name, values in self.columns.items():
+            values.append(record.get(name))
+
+    def frame(self):
+        # Records decoded, with the fields present in the response
+        if not self.finished:
+            raise ValueError("Incomplete SIMEM response")
+
+        return pl.DataFrame(
+            [
+                pl.Series(
+                    name,
+                    (
+                        [_number(value) for value in values]
+                        if COLUMNS[name] == pl.Float64
+                        else values
+                    ),
+                    dtype=COLUMNS[name],
+                )
+                for name, values in self.columns.items()
+                if any(value is not None for value in values)
+            ]
+        )
+
+
+async def _fetch_window(dataset_id, start_date, end_date, plantas=None):
+    # Get the records of a SIMEM dataset in a single date window as a DataFrame, decoding the response as it arrives and retrying timeouts, connection errors and server errors with exponential backoff
+    settings = _settings()
+    client = get_client()
+    url = httpx.URL(settings["base_url"])
+    params = {
+        "startdate": str(start_date),
+        "enddate": str(end_date),
+        "datasetId": dataset_id,
+    }
+
+    for attempt in range(settings["max_retries"] + 1):
+        decoder = RecordsDecoder(plantas)
+
+        try:
+            async with _host_semaphore(url.host):
+                async with client.stream("GET", url, params=params) as response:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        response.raise_for_status()
+
+                    if response.is_success:
+                        async for chunk in response.aiter_bytes():
+                            decoder.feed(chunk)
+        except (httpx.TransportError, httpx.HTTPStatusError):
+            if attempt == settings["max_retries"]:
+                raise
+
+            await asyncio.sleep(
+                settings["backoff_factor"] * 2**attempt * (1 + random.random())
+            )
+        else:
+            response.raise_for_status()
+            return decoder.frame()
+
+
+def _missing_ranges(days):
+    # Group consecutive missing days in (start, end) ranges
+    ranges = []
+
+    for day in days:
+        if len(ranges) > 0 and ranges[-1][1] + timedelta(days=1) == day:
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+
+    return ranges
+
+
+def _record_day(df):
+    # Day of each record, taken from "Fecha" (daily datasets) or "FechaHora" (hourly datasets)
+    column = "Fecha" if "Fecha" in df.columns else "FechaHora"
+
+    return pl.col(column).cast(pl.String).str.slice(offset=0, length=10)
+
+
+async def fetch_records(dataset_id, start_date, end_date, plantas=None):
+    # Get the records of a SIMEM dataset between two dates as a DataFrame (only the power generators in "plantas", when given), serving cached days from disk and requesting only the missing ones (in the windows allowed by the API, concurrently)
+    days = [
+        start_date + timedelta(days=offset)
+        for offset in range((end_date - start_date).days + 1)
+    ]
+    frames = await asyncio.to_thread(simem_cache.load, dataset_id, days, plantas)
+    missing_days = [day for day in days if frames[day] is None]
+
+    if len(missing_days) > 0:
+        windows = [
+            window
+            for range_start, range_end in _missing_ranges(missing_days)
+            for window in date_windows(
+                range_start, range_end, _settings()["max_window_days"]
+            )
+        ]
+        results = await asyncio.gather(
+            *[
+                _fetch_window(dataset_id, window_start, window_end, plantas)
+                for window_start, window_end in windows
+            ]
+        )
+        df_records = pl.concat(results, how="diagonal_relaxed")
+
+        # Split the records by day so each one is cached on its own
+        frames_records = (
+            df_records.with_columns(_record_day(df_records).alias("_dia")).partition_by(
+                "_dia", as_dict=True, include_key=False
+            )
+            if df_records.height > 0
+            else {}
+        )
+        frames_missing = {
+            day: frames_records.get((str(day),), df_records.clear())
+            for day in missing_days
+        }
+
+        await asyncio.to_thread(simem_cache.store, dataset_id, frames_missing, plantas)
+        frames.update(frames_missing)
+
+    return pl.concat([frames[day] for day in days], how="diagonal_relaxed")
+
+
+async def fetch_datasets(dataset_ids, start_date, end_date, plantas=None):
+    # Request several datasets concurrently; each result is either a DataFrame with the records or the exception raised by its request
+    results = await asyncio.gather(
+        *[
+            fetch_records(dataset_id, start_date, end_date, plantas)
+            for dataset_id in dataset_ids
+        ],
+        return_exceptions=True,
+    )
+
+    return dict(zip(dataset_ids, results))
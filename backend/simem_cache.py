@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import date
+
+import polars as pl
+
+# Modules
+import shared
+
+
+# Increase when the records saved change (fields or types), so older days are requested again
+SCHEMA_VERSION = 2
+
+# Guards the cache index against concurrent reads and writes from worker threads (and from the other workers with "shared.worker_lock")
+_lock = threading.Lock()
+
+
+def _settings():
+    return {
+        "enabled": os.getenv("SIMEM_CACHE_ENABLED", "true").lower() == "true",
+        "directory": os.getenv("SIMEM_CACHE_DIR", "simem_cache"),
+        "final_versions": os.getenv("SIMEM_CACHE_FINAL_VERSIONS", "TXR").split(","),
+        "ttl_today": int(os.getenv("SIMEM_CACHE_TTL_TODAY_SECONDS", "300")),
+        "ttl_provisional": int(os.getenv("SIMEM_CACHE_TTL_SECONDS", "3600")),
+        "max_bytes": int(os.getenv("SIMEM_CACHE_MAX_BYTES", str(512 * 1024**2))),
+    }
+
+
+def _index_path(settings):
+    return os.path.join(settings["directory"], "index.json")
+
+
+def _read_index(settings):
+    try:
+        with open(_index_path(settings), "r") as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_index(settings, index):
+    # Replace the index atomically so a crash never leaves it half written
+    os.makedirs(settings["directory"], exist_ok=True)
+    temporary_path = shared.temporary_name(_index_path(settings))
+
+    with open(temporary_path, "w") as index_file:
+        json.dump(index, index_file)
+
+    os.replace(temporary_path, _index_path(settings))
+
+
+def _entry_directory(settings, dataset_id, day):
+    return os.path.join(settings["directory"], dataset_id, str(day))
+
+
+def _is_fresh(settings, entry, day, plantas):
+    # Days saved with another schema, or filtered to power generators that do not include the requested ones, are requested again
+    if entry.get("schema") != SCHEMA_VERSION:
+        return False
+
+    if entry.get("plantas") is not None and (
+        plantas is None or not set(plantas) <= set(entry["plantas"])
+    ):
+        return False
+
+    # A day with a settled version never expires (SIMEM also keeps returning the earlier versions of a settled day); provisional data expires quickly for today (or later) and after a longer TTL for past days
+    if any(version in settings["final_versions"] for version in entry["versions"]):
+        return True
+
+    ttl = settings["ttl_today"] if day >= date.today() else settings["ttl_provisional"]
+
+    return time.time() - entry["fetched_at"] < ttl
+
+
+def _evict(settings, index):
+    # Remove least recently used days until the cache fits in the configured size
+    total_bytes = sum(entry["size"] for entry in index.values())
+
+    for key in sorted(index, key=lambda key: index[key]["last_access"]):
+        if total_bytes <= settings["max_bytes"]:
+            break
+
+        dataset_id, day = key.split("/")
+        shutil.rmtree(_entry_directory(settings, dataset_id, day), ignore_errors=True)
+        total_bytes -= index.pop(key)["size"]
+
+
+def load(dataset_id, days, plantas=None):
+    # Get the cached records of a dataset for each day (only the power generators in "plantas", when given), or None for the days that are missing or expired
+    settings = _settings()
+    frames = {day: None for day in days}
+
+    if not settings["enabled"]:
+        return frames
+
+    with _lock, shared.worker_lock("simem_cache"):
+        index = _read_index(settings)
+
+        for day in days:
+            entry = index.get(f"{dataset_id}/{day}")
+
+            if entry is None or not _is_fresh(settings, entry, day, plantas):
+                continue
+
+            directory = _entry_directory(settings, dataset_id, day)
+
+            try:
+                frames_versions = [
+                    pl.read_parquet(os.path.join(directory, f"{version}.parquet"))
+                    for version in entry["versions"]
+                ]
+            except FileNotFoundError:
+                continue
+
+            frames[day] = (
+                pl.concat(frames_versions, how="diagonal_relaxed")
+                if len(frames_versions) > 0
+                else pl.DataFrame()
+            )
+
+            # Days saved with more power generators than requested
+            if plantas is not None and "CodigoPlanta" in frames[day].columns:
+                frames[day] = frames[day].filter(pl.col("CodigoPlanta").is_in(plantas))
+
+            entry["last_access"] = time.time()
+
+        _write_index(settings, index)
+
+    return frames
+
+
+def store(dataset_id, frames, plantas=None):
+    # Save the records of a dataset for each day, one Parquet file per "Version" ("plantas" are the power generators the records were filtered to, if any)
+    settings = _settings()
+
+    if not settings["enabled"]:
+        return
+
+    with _lock, shared.worker_lock("simem_cache"):
+        index = _read_index(settings)
+
+        for day, df in frames.items():
+            directory = _entry_directory(settings, dataset_id, day)
+            versions = []
+
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory, exist_ok=True)
+
+            if "Version" in df.columns:
+                for (version,), df_version in df.group_by("Version"):
+                    versions.append(version)
+                    df_version.write_parquet(
+                        os.path.join(directory, f"{version}.parquet")
+                    )
+            elif df.height > 0:
+                versions.append("records")
+                df.write_parquet(os.path.join(directory, "records.parquet"))
+
+            index[f"{dataset_id}/{day}"] = {
+                "schema": SCHEMA_VERSION,
+                "plantas": (
+                    None
+                    if plantas is None
+                    or (df.width > 0 and "CodigoPlanta" not in df.columns)
+                    else sorted(plantas)
+                ),
+                "versions": versions,
+                "fetched_at": time.time(),
+                "last_access": time.time(),
+                "size": sum(
+                    os.path.getsize(os.path.join(directory, file_name))
+                    for file_name in os.listdir(directory)
+                ),
+            }
+
+        _evict(settings, index)
+        _write_index(settings, index)
@@ -0,0 +1,211 @@
+import os
+
+import polars as pl
+
+
+def debug_enabled():
+    # Print query plans and intermediate results only when ETL_DEBUG is enabled
+    return os.getenv("ETL_DEBUG", "false").lower() == "true"
+
+
+def streaming_enabled():
+    # Collect the query plan with Polars' streaming engine when ETL_STREAMING is enabled
+    return os.getenv("ETL_STREAMING", "false").lower() == "true"
+
+
+def _inspect(lf, name):
+    # Print the intermediate result of a step while the plan is collected (debug only)
+    if debug_enabled():
+        return lf.inspect(f"{name}:\n{{}}")
+
+    return lf
+
+
+def columnas_capacidad(generadores, strict=True):
+    # Compute "Fecha" and "Hora" columns from the date and hour of each record (a datetime read from the workbook), and rename the columns 2 and 3 to "Capacidad" and "Codigo"; casting "Capacidad" column (decimal kWh are truncated) to Int64 data type and "Codigo" column to the Enum of the power generators of interest
+    fecha_hora = pl.col("column_1")
+
+    return [
+        fecha_hora.dt.date().alias("Fecha"),
+        fecha_hora.dt.hour().cast(pl.String).str.zfill(2).alias("Hora"),
+        pl.col("column_2")
+        .cast(pl.Float64)
+        .cast(pl.Int64, strict=strict)
+        .alias("Capacidad (kWh)"),
+        pl.col("column_3").cast(generadores, strict=strict).alias("Codigo"),
+    ]
+
+
+def capacidad_generacion(lf_capacidad_generacion, generadores):
+    return _inspect(
+        lf_capacidad_generacion.select(*columnas_capacidad(generadores)),
+        "Capacidad de generación",
+    )
+
+
+def despacho_programado(lf_despacho_programado, generadores):
+    # Compute "Fecha" and "Hora" columns, and select "Valor" (renamed as "Compromiso") and "CodigoPlanta" (renamed as "Codigo") columns; casting "Valor" column to Int64 data type. Then, filter rows with "Codigo" values associated with the power generators of interest (codes outside the Enum become null)
+    lf_despacho_programado = lf_despacho_programado.select(
+        pl.col("FechaHora")
+        .str.slice(offset=0, length=10)
+        .str.to_date("%Y-%m-%d")
+        .alias("Fecha"),
+        pl.col("FechaHora").str.slice(offset=11, length=2).alias("Hora"),
+        pl.col("Valor").cast(pl.Int64).alias("Compromiso (kWh)"),
+        pl.col("CodigoPlanta").cast(generadores, strict=False).alias("Codigo"),
+    ).filter(pl.col("Codigo").is_not_null())
+
+    return _inspect(lf_despacho_programado, "Despacho programado")
+
+
+def precio_bolsa(lf_precio_bolsa):
+    # Filter values with "CodigoVariable" equal to "PPBOGReal" and "Version" equal to "TXR", keeping the date of each daily price
+    columna_fecha_precio = (
+        "Fecha" if "Fecha" in lf_precio_bolsa.collect_schema().names() else "FechaHora"
+    )
+
+    lf_precio_bolsa = lf_precio_bolsa.filter(
+        (pl.col("CodigoVariable") == "PPBOGReal") & (pl.col("Version") == "TXR")
+    ).select(
+        pl.col(columna_fecha_precio)
+        .str.slice(offset=0, length=10)
+        .str.to_date("%Y-%m-%d")
+        .alias("Fecha"),
+        pl.col("Valor").cast(pl.Float64).alias("Precio Bolsa (COP/kWh)"),
+    )
+
+    return _inspect(lf_precio_bolsa, "Precio de bolsa ponderado")
+
+
+def balance_horario(lf_capacidad_generacion, lf_despacho_programado):
+    # Join hourly dispatch and capacity of each power generator
+    return _inspect(
+        lf_despacho_programado.join(
+            other=lf_capacidad_generacion, on=["Fecha", "Hora", "Codigo"], how="inner"
+        ),
+        "Balance de energía",
+    )
+
+
+def precio_bolsa_horario(lf_precio_bolsa_horario):
+    # Filter values with "CodigoVariable" equal to "PB_Nal" (national hourly price) and "Version" equal to "TXR", keeping the date and hour of each price
+    lf_precio_bolsa_horario = lf_precio_bolsa_horario.filter(
+        (pl.col("CodigoVariable") == "PB_Nal") & (pl.col("Version") == "TXR")
+    ).select(
+        pl.col("FechaHora")
+        .str.slice(offset=0, length=10)
+        .str.to_date("%Y-%m-%d")
+        .alias("Fecha"),
+        pl.col("FechaHora").str.slice(offset=11, length=2).alias("Hora"),
+        pl.col("Valor").cast(pl.Float64).alias("Precio Bolsa (COP/kWh)"),
+    )
+
+    return _inspect(lf_precio_bolsa_horario, "Precio de bolsa horario")
+
+
+def balance_energia_horario(lf_balance_horario, lf_precio_bolsa_horario=None):
+    # Hourly balance of each power generator; when hourly prices are given, each hour is priced with the price of the same hour
+    lf_balance_energia_horario = lf_balance_horario.select(
+        pl.col("Fecha"),
+        pl.col("Hora"),
+        pl.col("Codigo").cast(pl.String),
+        pl.col("Capacidad (kWh)"),
+        pl.col("Compromiso (kWh)"),
+        (pl.col("Capacidad (kWh)") - pl.col("Compromiso (kWh)")).alias("Balance (kWh)"),
+    )
+
+    if lf_precio_bolsa_horario is not None:
+        lf_balance_energia_horario = lf_balance_energia_horario.join(
+            other=lf_precio_bolsa_horario, on=["Fecha", "Hora"], how="left"
+        ).with_columns(
+            (pl.col("Balance (kWh)") * pl.col("Precio Bolsa (COP/kWh)"))
+            .cast(pl.Int64)
+            .alias("Compromisos (COP)")
+        )
+
+    return lf_balance_energia_horario.with_columns(
+        pl.when(pl.col("Balance (kWh)") > 0)
+        .then(pl.lit("Vender"))
+        .otherwise(pl.lit("Comprar"))
+        .alias("Operacion")
+    ).sort(["Fecha", "Codigo", "Hora"])
+
+
+def balance_energia(lf_balance_horario, lf_precio_bolsa):
+    # Add up the hourly balance by date and power generator, and price the balance of each day with the "Precio de bolsa ponderado" of the same date
+    lf_balance_energia_consolidado = _inspect(
+        lf_balance_horario.group_by(["Fecha", "Codigo"])
+        .agg(
+            pl.sum("Capacidad (kWh)").alias("Capacidad Total (kWh)"),
+            pl.sum("Compromiso (kWh)").alias("Compromiso Total (kWh)"),
+        )
+        .select(
+            pl.col("Fecha"),
+            pl.col("Codigo"),
+            (pl.col("Capacidad Total (kWh)") - pl.col("Compromiso Total (kWh)")).alias(
+                "Balance (kWh)"
+            ),
+        ),
+        "Balance de energía consolidado",
+    )
+
+    return (
+        lf_balance_energia_consolidado.join(
+            other=lf_precio_bolsa, on="Fecha", how="left"
+        )
+        .select(
+            pl.col("Fecha"),
+            pl.col("Codigo").cast(pl.String),
+            pl.col("Balance (kWh)"),
+            (pl.col("Balance (kWh)") * pl.col("Precio Bolsa (COP/kWh)"))
+            .cast(pl.Int64)
+            .alias("Compromisos (COP)"),
+            pl.when(pl.col("Balance (kWh)") > 0)
+            .then(pl.lit("Vender"))
+            .otherwise(pl.lit("Comprar"))
+            .alias("Operacion"),
+        )
+        .sort(["Fecha", "Codigo"])
+    )
+
+
+def totales_escenarios(lf_balance_horario, lf_precio_bolsa):
+    # Capacity and commitment of each power generator over the whole run, in kWh and priced with the "Precio de bolsa ponderado" of each date, so scenarios are evaluated on one row per power generator
+    return (
+        lf_balance_horario.group_by(["Fecha", "Codigo"])
+        .agg(
+            pl.sum("Capacidad (kWh)").alias("Capacidad Total (kWh)"),
+            pl.sum("Compromiso (kWh)").alias("Compromiso Total (kWh)"),
+        )
+        .join(other=lf_precio_bolsa, on="Fecha", how="left")
+        .group_by("Codigo")
+        .agg(
+            pl.sum("Capacidad Total (kWh)"),
+            pl.sum("Compromiso Total (kWh)"),
+            (pl.col("Capacidad Total (kWh)") * pl.col("Precio Bolsa (COP/kWh)"))
+            .sum()
+            .alias("Capacidad Total (COP)"),
+            (pl.col("Compromiso Total (kWh)") * pl.col("Precio Bolsa (COP/kWh)"))
+            .sum()
+            .alias("Compromiso Total (COP)"),
+        )
+        .with_columns(pl.col("Codigo").cast(pl.String))
+        .sort("Codigo")
+    )
+
+
+def collect(lf):
+    # Collect the whole plan once, printing the optimized plan first in debug mode
+    if debug_enabled():
+        print(lf.explain(streaming=streaming_enabled()))
+
+    return lf.collect(streaming=streaming_enabled())
+
+
+def collect_all(lfs):
+    # Collect several plans at once, in parallel (a subplan shared by them is computed once per plan, so collect it first and build the plans on its result)
+    if debug_enabled():
+        for lf in lfs:
+            print(lf.explain(streaming=streaming_enabled()))
+
+    return pl.collect_all(lfs, streaming=streaming_enabled())
@@ -0,0 +1,99 @@
+import polars as pl
+
+# Modules
+import transform
+
+
+# Maximum number of row numbers included in the message of a failed rule
+MAX_FILAS_MENSAJE = 10
+
+
+def reglas_capacidad(generadores, filas_esperadas=None, fecha_unica=True):
+    # Rules for the "capacidad de generación" file ("generadores" is the Enum of the power generators of interest). Row rules ("filas") are True for every offending row; table rules ("tabla") are True when the whole file is invalid. Cells that could not be read as a date or a number keep their text in "column_1_texto" and "column_2_texto"
+    fecha, hora, capacidad, codigo = transform.columnas_capacidad(
+        generadores, strict=False
+    )
+
+    reglas = [
+        {
+            "filas": pl.col("column_1").is_null() & pl.col("column_1_texto").is_null(),
+            "mensaje": 'El archivo de capacidad de generación contiene valores nulos en la columna "FECHA"',
+        },
+        {
+            "filas": pl.col("column_2").is_null() & pl.col("column_2_texto").is_null(),
+            "mensaje": 'El archivo de capacidad de generación contiene valores nulos en la columna "CAPACIDAD (Kwh)"',
+        },
+        {
+            "filas": pl.col("column_3").is_null(),
+            "mensaje": 'El archivo de capacidad de generación contiene valores nulos en la columna "CODIGO"',
+        },
+        {
+            "filas": pl.col("column_1_texto").is_not_null(),
+            "mensaje": "El archivo de capacidad de generación contiene al menos un registro con una fecha no válida",
+        },
+        {
+            "filas": pl.col("column_2_texto").is_not_null()
+            | (pl.col("column_2").is_not_null() & capacidad.is_null()),
+            "mensaje": 'El archivo de capacidad de generación contiene al menos un registro con un valor no numérico en la columna "CAPACIDAD (Kwh)"',
+        },
+        {
+            "filas": pl.col("column_3").is_not_null() & codigo.is_null(),
+            "mensaje": 'El archivo de capacidad de generación contiene al menos un registro con un valor diferente a los generadores de interés en la columna "CODIGO"',
+        },
+        {
+            # Several files (range, date and incremental runs) may hold the same hour of a power generator, e.g. a corrected copy next to the original; the join would count it twice
+            "filas": fecha.is_not_null()
+            & codigo.is_not_null()
+            & pl.struct(fecha, hora, codigo).is_duplicated(),
+            "mensaje": "El archivo de capacidad de generación contiene registros repetidos de la misma fecha, hora y generador",
+        },
+    ]
+
+    if filas_esperadas is not None:
+        reglas.append(
+            {
+                "tabla": pl.len() < filas_esperadas,
+                "mensaje": f"El archivo de capacidad de generación contiene menos de {filas_esperadas} registros",
+            }
+        )
+
+    if fecha_unica:
+        reglas.append(
+            {
+                "tabla": fecha.min() != fecha.max(),
+                "mensaje": "El archivo de capacidad de generación contiene al menos un registro con una fecha distinta a las demás",
+            }
+        )
+
+    return reglas
+
+
+def validar(df, reglas):
+    # Evaluate every rule in a single pass over the DataFrame, which must include the "Fila" column with the row number of each record in the source file, and return one error message per failed rule
+    resultado = df.select(
+        *[
+            (
+                pl.col("Fila").filter(regla["filas"]).implode()
+                if "filas" in regla
+                else regla["tabla"].fill_null(False)
+            ).alias(f"regla_{index}")
+            for index, regla in enumerate(reglas)
+        ]
+    ).row(0)
+
+    errores = []
+
+    for regla, valor in zip(reglas, resultado):
+        if "filas" in regla and len(valor) > 0:
+            filas = ", ".join(str(fila) for fila in valor[:MAX_FILAS_MENSAJE])
+            errores.append(
+                {
+                    "status": "error",
+                    "content": f"{regla['mensaje']} (filas: {filas}{', ...' if len(valor) > MAX_FILAS_MENSAJE else ''})",
+                    "filas": valor,
+                }
+            )
+        elif "tabla" in regla and valor:
+            errores.append({"status": "error", "content": regla["mensaje"]})
+
+    return errores
@@ -1,4 +1,4 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { useNavigate } from "react-router-dom";
 import socket from "@/socket";
 
@@ -29,12 +29,36 @@ import { Check, DatabaseZap, LoaderCircle, Server, X } from "lucide-react";
 
 const thousandsFormatter = new Intl.NumberFormat("es-CO");
 
+// Decode a chunk of the results sent as column-oriented JSON (optionally gzip compressed)
+const decodeChunk = async (message) => {
+  let bytes = new Uint8Array(message.data);
+
+  if (message.compression === "gzip") {
+    const stream = new Blob([bytes])
+      .stream()
+      .pipeThrough(new DecompressionStream("gzip"));
+    bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+  }
+
+  return JSON.parse(new TextDecoder().decode(bytes));
+};
+
+const columnsToRows = (columns) => {
+  const keys = Object.keys(columns);
+  const length = keys.length > 0 ? columns[keys[0]].length : 0;
+
+  return Array.from({ length }, (_, index) =>
+    Object.fromEntries(keys.map((key) => [key, columns[key][index]]))
+  );
+};
+
 export default function ETL() {
   const [isServerUp, setIsServerUp] = useState(false);
   const [isConnected, setIsConnected] = useState(socket.connected);
   const [loading, setLoading] = useState(false);
   const [eventsMessages, setEventsMessages] = useState([]);
   const [energyBalance, setEnergyBalance] = useState([]);
+  const energyBalanceChunks = useRef([]);
 
   const navigate = useNavigate();
 
@@ -64,13 +88,40 @@ export default function ETL() {
     socket.emit("send_report");
   };
 
-  const onConnect = () => setIsConnected(true);
+  const onConnect = () => {
+    setIsConnected(true);
+
+    // Ask for the results as compressed column-oriented JSON chunks when the browser can decompress them
+    socket.emit("negotiate_payload", {
+      formats: ["columnar"],
+      compression: "DecompressionStream" in window ? ["gzip"] : [],
+    });
+  };
   const onEventsMessages = (message) => {
-    setEventsMessages((prev) => [...prev, message]);
+    // The server may send a single message or a batch of messages
+    setEventsMessages((prev) =>
+      prev.concat(Array.isArray(message) ? message : [message])
+    );
   };
   const onStopProcessing = () => setLoading(false);
-  const onEnergyBalance = (message) => {
-    setEnergyBalance(JSON.parse(message));
+  const onEnergyBalance = async (message) => {
+    // Row-oriented JSON string (default encoding)
+    if (typeof message === "string") {
+      setEnergyBalance(JSON.parse(message));
+      return;
+    }
+
+    // Column-oriented chunks, decoded as they arrive and shown when the last one is received
+    if (message.chunk === 0) {
+      energyBalanceChunks.current = [];
+    }
+
+    energyBalanceChunks.current[message.chunk] = decodeChunk(message);
+
+    if (message.chunk === message.chunks - 1) {
+      const chunks = await Promise.all(energyBalanceChunks.current);
+      setEnergyBalance(chunks.flatMap(columnsToRows));
+    }
   };
   const onDenyReport = () => {
     setEventsMessages([]);